@@ -7,8 +7,9 @@ Outputs a human-readable report to stdout and writes
 """
 import csv
 import os
-from collections import Counter, defaultdict
+from collections import Counter
 import math
+from operator import itemgetter
 import re
 
 ROOT = os.path.dirname(os.path.dirname(__file__))
@@ -16,138 +17,160 @@ CSV_PATH = os.path.join(ROOT, '_out', 'highlights.csv')
 OUT_DIR = os.path.join(ROOT, '_out', 'reports')
 os.makedirs(OUT_DIR, exist_ok=True)
 
+# capture Japanese chars (kanji/hiragana/katakana) and latin words/numbers;
+# runs shorter than 2 chars are filtered out by the regex itself
+_TOKEN_RE = re.compile(r'[\u4E00-\u9FFF\u3040-\u309F\u30A0-\u30FF0-9A-Za-z]{2,}')
+# number of highlights tokenized per regex call; texts are joined with a
+# newline, which is outside the token class, so tokens never merge
+TOKEN_BATCH = 2048
+
 def tokenize_jp_en(text):
     if not text:
         return []
-    # capture Japanese chars (kanji/hiragana/katakana) and latin words/numbers
-    tokens = re.findall(r'[\u4E00-\u9FFF\u3040-\u309F\u30A0-\u30FF0-9A-Za-z]+', text)
-    # filter short tokens
-    return [t for t in tokens if len(t) >= 2]
-
-def stats(lengths):
-    if not lengths:
+    return _TOKEN_RE.findall(text)
+
+def nth_smallest(hist, k):
+    """Return the k-th (0-based) smallest value of a {value: count} histogram."""
+    for v in sorted(hist):
+        k -= hist[v]
+        if k < 0:
+            return v
+    return None
+
+def stats(hist):
+    """Length statistics from a {length: count} histogram."""
+    if not hist:
         return {}
-    n = len(lengths)
-    s = sum(lengths)
+    n = sum(hist.values())
+    s = sum(l * c for l, c in hist.items())
     mean = s / n
-    lengths_sorted = sorted(lengths)
-    p50 = lengths_sorted[n//2]
-    p90 = lengths_sorted[int(n*0.9)-1 if n*0.9>=1 else -1]
-    return {'count': n, 'sum': s, 'mean': mean, 'min': lengths_sorted[0], 'p50': p50, 'p90': p90, 'max': lengths_sorted[-1]}
+    # order statistics are read off the few distinct lengths
+    # instead of sorting every value
+    p50 = nth_smallest(hist, n//2)
+    p90 = nth_smallest(hist, int(n*0.9)-1 if n*0.9>=1 else n-1)
+    return {'count': n, 'sum': s, 'mean': mean, 'min': min(hist), 'p50': p50, 'p90': p90, 'max': max(hist)}
 
 def main():
-    rows = []
-    with open(CSV_PATH, newline='', encoding='utf-8') as f:
-        reader = csv.DictReader(f)
-        # normalize fieldnames to remove BOM and surrounding whitespace
-        if reader.fieldnames:
-            norm = [fn.replace('\ufeff', '').strip() for fn in reader.fieldnames]
-            reader.fieldnames = norm
-        for r in reader:
-            # also normalize keys in each row dict
-            nr = { (k.replace('\ufeff','').strip() if k is not None else k): v for k,v in r.items() }
-            rows.append(nr)
-
-    total_rows = len(rows)
-    columns = reader.fieldnames or []
-
-    # missing counts
+    total_rows = 0
     missing = Counter()
-    for r in rows:
-        for c in columns:
-            if r.get(c, '') is None or r.get(c, '').strip() == '':
-                missing[c] += 1
-
-    # per-book aggregation
     book_counts = Counter()
-    book_notes = defaultdict(list)
-    for r in rows:
-        book = (r.get('Book') or '').strip()
-        highlight = (r.get('Highlight') or '').strip()
-        note = (r.get('Note') or '').strip()
-        # consider a row a highlight if Highlight or Note non-empty
-        if highlight or note:
-            book_counts[book] += 1
-            if highlight:
-                book_notes[book].append(highlight)
-            elif note:
-                book_notes[book].append(note)
-
-    unique_books = len([b for b in book_counts if b])
-
-    # duplicates
-    seen = Counter()
-    dup_count = 0
-    for r in rows:
-        book = (r.get('Book') or '').strip()
-        highlight = (r.get('Highlight') or '').strip()
-        note = (r.get('Note') or '').strip()
-        key = (book, highlight)
-        seen[key] += 1
-    duplicates = {k:v for k,v in seen.items() if k[0] and k[1] and v > 1}
-
-    # highlight lengths
-    lengths = []
+    seen = set()
+    dups = {}
+    length_hist = Counter()
     text_samples = []
-    for r in rows:
-        text = (r.get('Highlight') or '').strip()
-        if not text:
-            text = (r.get('Note') or '').strip()
-        if text:
+    token_counter = Counter()
+    token_batch = []
+
+    # single pass over the raw rows: every aggregator is fed from the same loop
+    with open(CSV_PATH, newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        # normalize fieldnames once to remove BOM and surrounding whitespace
+        header = next(reader, None) or []
+        columns = [fn.replace('\ufeff', '').strip() for fn in header]
+        col_idx = {name: i for i, name in enumerate(columns)}
+        col_pairs = tuple(enumerate(columns))
+        width = len(columns)
+        bi = col_idx.get('Book')
+        hi = col_idx.get('Highlight')
+        ni = col_idx.get('Note')
+
+        for row in reader:
+            if not row:
+                # blank line (DictReader skips these as well)
+                continue
+            total_rows += 1
+            # short rows: treat absent trailing cells as empty
+            if len(row) < width:
+                row.extend([''] * (width - len(row)))
+
+            # missing counts
+            for i, c in col_pairs:
+                if not row[i].strip():
+                    missing[c] += 1
+
+            book = row[bi].strip() if bi is not None else ''
+            hl = row[hi].strip() if hi is not None else ''
+            note = row[ni].strip() if ni is not None else ''
+
+            # duplicates: first sighting goes to `seen`, repeats are counted in `dups`
+            if book and hl:
+                k = (book, hl)
+                if k in dups:
+                    dups[k] += 1
+                elif k in seen:
+                    dups[k] = 2
+                else:
+                    seen.add(k)
+
+            # consider a row a highlight if Highlight or Note non-empty
+            text = hl or note
+            if not text:
+                continue
+
+            # per-book aggregation
+            book_counts[book] += 1
+
+            # highlight lengths
             l = len(text)
-            lengths.append(l)
+            length_hist[l] += 1
             if len(text_samples) < 10:
                 text_samples.append((l, text[:200].replace('\n', ' ')))
 
-    length_stats = stats(lengths)
+            # frequent tokens
+            token_batch.append(text)
+            if len(token_batch) >= TOKEN_BATCH:
+                token_counter.update(_TOKEN_RE.findall('\n'.join(token_batch)))
+                token_batch.clear()
 
-    # frequent tokens
-    token_counter = Counter()
-    for r in rows:
-        text = (r.get('Highlight') or '').strip()
-        if not text:
-            text = (r.get('Note') or '').strip()
-        if text:
-            for t in tokenize_jp_en(text):
-                token_counter[t] += 1
+    if token_batch:
+        token_counter.update(_TOKEN_RE.findall('\n'.join(token_batch)))
+
+    # every aggregate comes out of the scan above; only the '' book is discounted
+    unique_books = len(book_counts) - ('' in book_counts)
+    length_stats = stats(length_hist)
 
     top_tokens = token_counter.most_common(40)
+    # book_counts.csv needs the full ranking anyway, so sort once and take
+    # the top 15 from it (stable, same order as Counter.most_common)
+    ranked_books = sorted(book_counts.items(), key=itemgetter(1), reverse=True)
+
+    # write outputs: the report is collected as lines and written in one go
+    lines = []
+    w = lambda *a: lines.append(' '.join(map(str,a)) + '\n')
+    w('highlights.csv profile')
+    w('total_rows:', total_rows)
+    w('columns:', ', '.join(columns))
+    w('missing per column:')
+    for c in columns:
+        w(f'  {c}: {missing[c]}')
+    w('unique books with highlights:', unique_books)
+    w('top 15 books by highlight count:')
+    for book, cnt in ranked_books[:15]:
+        w(f'  {cnt:5d}  {book[:80]}')
+    w('duplicate highlights (book, highlight) count >1 :', len(dups))
+    if dups:
+        for (book, hl), cnt in list(dups.items())[:20]:
+            w(f'  {cnt:3d}x  {book[:60]}  /  {hl[:120]}')
+    w('highlight length stats (chars):')
+    for k,v in (length_stats or {}).items():
+        w(f'  {k}: {v}')
+    w('sample highlights (len, prefix):')
+    for l, s in text_samples:
+        w(f'  {l:4d}  {s}')
+    w('top tokens (token, count):')
+    for t,cnt in top_tokens[:40]:
+        w(f'  {cnt:5d}  {t}')
 
-    # write outputs
     report_path = os.path.join(OUT_DIR, 'highlights_profile.txt')
     with open(report_path, 'w', encoding='utf-8') as out:
-        w = lambda *a, **k: out.write(' '.join(map(str,a)) + (k.get('end','\n')))
-        w('highlights.csv profile')
-        w('total_rows:', total_rows)
-        w('columns:', ', '.join(columns))
-        w('missing per column:')
-        for c in columns:
-            w(f'  {c}: {missing[c]}')
-        w('unique books with highlights:', unique_books)
-        w('top 15 books by highlight count:')
-        for book, cnt in book_counts.most_common(15):
-            w(f'  {cnt:5d}  {book[:80]}')
-        w('duplicate highlights (book, highlight) count >1 :', len(duplicates))
-        if duplicates:
-            for (book, hl), cnt in list(duplicates.items())[:20]:
-                w(f'  {cnt:3d}x  {book[:60]}  /  {hl[:120]}')
-        w('highlight length stats (chars):')
-        for k,v in (length_stats or {}).items():
-            w(f'  {k}: {v}')
-        w('sample highlights (len, prefix):')
-        for l, s in text_samples:
-            w(f'  {l:4d}  {s}')
-        w('top tokens (token, count):')
-        for t,cnt in top_tokens[:40]:
-            w(f'  {cnt:5d}  {t}')
+        out.writelines(lines)
 
     # per-book CSV
     book_csv = os.path.join(OUT_DIR, 'book_counts.csv')
     with open(book_csv, 'w', encoding='utf-8', newline='') as bf:
         writer = csv.writer(bf)
         writer.writerow(['book','highlight_count'])
-        for book, cnt in book_counts.most_common():
-            writer.writerow([book, cnt])
+        writer.writerows(ranked_books)
 
     # also print brief summary to stdout
     print('report written to', report_path)
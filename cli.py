@@ -31,14 +31,8 @@ sys.path.append(str(ROOT / 'debug_notebook_dom'))
 sys.path.append(str(ROOT / 'export_highlights_to_obsidian'))
 
 # --- メインスクリプトのインポート ---
-# 各スクリプトのmain関数を、別名でインポートします。
-# これにより、CLIの各サブコマンドから対応するスクリプトの処理を呼び出せます。
-from scrape_notebook_highlight_to_csv import main as scrape_highlights_main
-from scrape_library_booklist_to_csv import main as scrape_library_main
-from format_highlights_csv_to_json import main as format_json_main
-from analyze_highlights_csv_to_report import main as analyze_main
-from debug_notebook_dom import main as debug_dom_main
-from export_highlights_to_obsidian import main as export_to_obsidian_main
+# 各スクリプトのmain関数は、対応する `run_*` 関数の中で遅延インポートします。
+# Playwright などの重い依存は、選択されたサブコマンドが必要とする場合にだけ読み込まれます。
 
 
 def run_scrape_highlights(args: argparse.Namespace) -> None:
@@ -49,9 +43,11 @@ def run_scrape_highlights(args: argparse.Namespace) -> None:
 
     Args:
         args (argparse.Namespace): argparseによってパースされたコマンドライン引数。
-                                   `headful` と `output` 属性を持ちます。
+                                   `headful`、`output`、`workers` 属性を持ちます。
                                    型: argparse.Namespace (名前空間)
     """
+    from scrape_notebook_highlight_to_csv import main as scrape_highlights_main
+
     print("Kindleハイライトのスクレイピングを開始します...")
     # scrape_highlights_main.main は非同期関数のため asyncio.run で実行
     asyncio.run(scrape_highlights_main.main(args))
@@ -68,6 +64,8 @@ def run_scrape_library(args: argparse.Namespace) -> None:
                                    このコマンドでは使用されません。
                                    型: argparse.Namespace (名前空間)
     """
+    from scrape_library_booklist_to_csv import main as scrape_library_main
+
     print("Kindleライブラリの書籍リストのスクレイピングを開始します...")
     scrape_library_main.main()
     print("スクレイピングが完了しました。")
@@ -83,6 +81,8 @@ def run_format_json(args: argparse.Namespace) -> None:
                                    このコマンドでは使用されません。
                                    型: argparse.Namespace (名前空間)
     """
+    from format_highlights_csv_to_json import main as format_json_main
+
     print("ハイライトCSVのJSONへの変換を開始します...")
     format_json_main.main()
     print("変換が完了しました。")
@@ -98,6 +98,8 @@ def run_analyze(args: argparse.Namespace) -> None:
                                    このコマンドでは使用されません。
                                    型: argparse.Namespace (名前空間)
     """
+    from analyze_highlights_csv_to_report import main as analyze_main
+
     print("ハイライトCSVの分析とレポート生成を開始します...")
     analyze_main.main()
     print("分析が完了しました。")
@@ -114,6 +116,8 @@ def run_debug_dom(args: argparse.Namespace) -> None:
                                    このコマンドでは使用されません。
                                    型: argparse.Namespace (名前空間)
     """
+    from debug_notebook_dom import main as debug_dom_main
+
     print("DOMのデバッグを開始します...")
     # debug_dom_main.main は非同期関数のため asyncio.run で実行
     asyncio.run(debug_dom_main.main())
@@ -130,6 +134,8 @@ def run_export_to_obsidian(args: argparse.Namespace) -> None:
                                    `input` と `output` 属性を持ちます。
                                    型: argparse.Namespace (名前空間)
     """
+    from export_highlights_to_obsidian import main as export_to_obsidian_main
+
     print("Obsidianへのエクスポートを開始します...")
     export_to_obsidian_main.export_to_obsidian(args.input, args.output)
     print("エクスポートが完了しました。")
@@ -164,6 +170,12 @@ def main() -> None:
         default='_out/highlights.csv',
         help='出力先のCSVファイルパス。 (デフォルト: _out/highlights.csv)'
     )
+    parser_scrape_highlights.add_argument(
+        '--workers',
+        type=int,
+        default=1,
+        help='書籍を並行に処理するページ（タブ）の数。 (デフォルト: 1)'
+    )
     parser_scrape_highlights.set_defaults(func=run_scrape_highlights)
 
     # --- `scrape-library` コマンドの定義 ---
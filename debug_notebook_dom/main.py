@@ -14,7 +14,6 @@ async def main():
         input()
 
         # ページの主要なノードを調べる
-        html = await page.content()
         print("=== ページタイトル ===")
         print(await page.title())
 
@@ -1,7 +1,9 @@
+import csv
 import os
-import pandas as pd
 import re
 import hashlib
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
 def sanitize_filename(filename):
     """
@@ -17,18 +19,31 @@ def export_to_obsidian(input_csv_path: str, output_dir: str):
         input_csv_path (str): The path to the input CSV file.
         output_dir (str): The path to the directory where the Markdown files will be saved.
     """
-    df = pd.read_csv(input_csv_path)
+    # group rows by book in first-seen order; cells stay plain strings
+    with open(input_csv_path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.reader(f)
+        header = next(reader, None) or []
+        col_idx = {name: i for i, name in enumerate(header)}
+        width = len(header)
+        book_idx = col_idx.get("Book")
+        groups = defaultdict(list)
+        if book_idx is not None:
+            for row in reader:
+                if len(row) < width:
+                    row.extend([""] * (width - len(row)))
+                if row and row[book_idx]:
+                    groups[row[book_idx]].append(row)
 
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
     def _clean_location(loc):
         """Return digits-only location (remove commas/other chars) or None."""
-        if pd.isna(loc):
+        if not loc:
             return None
-        s = str(loc)
-        # remove non-digit characters (commas, spaces, quotes etc.)
-        digits = re.sub(r"\D", "", s)
+        # remove non-digit characters (commas, spaces, quotes etc.);
+        # str.isdecimal matches the same characters as the regex \d
+        digits = "".join(filter(str.isdecimal, loc))
         return digits or None
 
     def _build_kindle_link(asin, location_digits):
@@ -39,83 +54,111 @@ def export_to_obsidian(input_csv_path: str, output_dir: str):
             return f"{base}&location={location_digits}"
         return base
 
-    def _choose_author(row):
-        # try common author column names
-        for col in ("Author", "Authors", "Author(s)"):
-            if col in row.index and pd.notna(row.get(col)):
-                return str(row.get(col))
-        return None
-
     def _make_ref_id(text, location, asin):
-        key = (str(text) + str(location or "") + str(asin or "")).encode("utf-8")
-        return hashlib.md5(key).hexdigest()[:8]
-
-    for title, group in df.groupby("Book"):
+        # keep md5 so ref ids stay stable across exports (Obsidian block links
+        # point at them); feeding the parts one by one yields the same digest
+        # as hashing the concatenated key
+        h = hashlib.md5(usedforsecurity=False)
+        h.update(str(text).encode("utf-8"))
+        h.update(str(location or "").encode("utf-8"))
+        h.update(str(asin or "").encode("utf-8"))
+        return h.hexdigest()[:8]
+
+    # the columns are the same for every book, so resolve them once
+    highlight_idx = col_idx.get("Highlight")
+    location_idx = col_idx.get("Location")
+    asin_idx = col_idx.get("ASIN")
+    # try common author column names
+    author_idxs = [col_idx[c] for c in ("Author", "Authors", "Author(s)") if c in col_idx]
+
+    def _write_book(item):
+        """Render one book's highlights and write them to its Markdown file."""
+        title, rows = item
         sanitized_title = sanitize_filename(title)
         output_filepath = os.path.join(output_dir, f"{sanitized_title}.md")
-        with open(output_filepath, "w", encoding="utf-8") as f:
-            # Header
-            f.write(f"# {title}\n")
-
-            # Image (best-effort from ASIN)
-            # Assumption: construct a m.media-amazon.com image URL from ASIN
-            any_asin = None
-            if "ASIN" in group.columns:
-                any_asin = group["ASIN"].dropna().astype(str).iloc[0] if not group["ASIN"].dropna().empty else None
-
-            # Metadata
-            f.write("## Metadata\n")
-            # Author: try to pick from first non-empty row
-            any_author = None
-            for _, r in group.iterrows():
-                a = _choose_author(r)
-                if a:
-                    any_author = a
-                    break
-            f.write(f"* Author: {any_author or ''}\n")
-            f.write(f"* ASIN: {any_asin or ''}\n")
-            if any_asin:
-                f.write(f"* Reference: https://www.amazon.co.jp/dp/{any_asin}\n")
-            # Kindle link (top-level)
-            top_kindle = _build_kindle_link(any_asin, None)
-            if top_kindle:
-                f.write(f"* [Kindle link]({top_kindle})\n")
-
-            f.write("\n## Highlights\n")
-
-            # write each highlight in requested format
-            first = True
-            for _, row in group.iterrows():
-                highlight = row.get("Highlight", "")
-                if pd.isna(highlight) or str(highlight).strip() == "":
-                    continue
-                location = row.get("Location", None) if "Location" in row.index else None
-                asin = row.get("ASIN", None) if "ASIN" in row.index else any_asin
-
-                loc_digits = _clean_location(location)
-                kindle_link = _build_kindle_link(asin, loc_digits)
-
-                # compute a short ref id
-                ref_id = _make_ref_id(highlight, loc_digits, asin)
-
-                # highlight text (no blockquote)
-                f.write(f"{highlight} ")
-
-                # location + kindle link
-                loc_display = loc_digits if loc_digits else (str(location) if pd.notna(location) else "")
-                if loc_display:
-                    if kindle_link:
-                        f.write(f"— location: [{loc_display}]({kindle_link}) ")
-                    else:
-                        f.write(f"— location: [{loc_display}] ")
+        # collect the whole note and write it with a single call
+        parts = []
+        # Header
+        parts.append(f"# {title}\n")
+
+        # Image (best-effort from ASIN)
+        # Assumption: construct a m.media-amazon.com image URL from ASIN
+        any_asin = None
+        if asin_idx is not None:
+            any_asin = next((r[asin_idx] for r in rows if r[asin_idx]), None)
+
+        # Metadata
+        parts.append("## Metadata\n")
+        # Author: try to pick from first non-empty row
+        # (skipped entirely when the CSV has no author column, as scraped files don't)
+        any_author = None
+        if author_idxs:
+            any_author = next((r[i] for r in rows for i in author_idxs if r[i]), None)
+        parts.append(f"* Author: {any_author or ''}\n")
+        parts.append(f"* ASIN: {any_asin or ''}\n")
+        if any_asin:
+            parts.append(f"* Reference: https://www.amazon.co.jp/dp/{any_asin}\n")
+        # Kindle link (top-level)
+        top_kindle = _build_kindle_link(any_asin, None)
+        if top_kindle:
+            parts.append(f"* [Kindle link]({top_kindle})\n")
+
+        parts.append("\n## Highlights\n")
+
+        # write each highlight in requested format
+        for row in rows:
+            highlight = row[highlight_idx] if highlight_idx is not None else ""
+            if not highlight.strip():
+                continue
+            location = row[location_idx] if location_idx is not None else None
+            asin = row[asin_idx] if asin_idx is not None else any_asin
+
+            loc_digits = _clean_location(location)
+            kindle_link = _build_kindle_link(asin, loc_digits)
+
+            # compute a short ref id
+            ref_id = _make_ref_id(highlight, loc_digits, asin)
+
+            # highlight text (no blockquote)
+            parts.append(f"{highlight} ")
+
+            # location + kindle link
+            loc_display = loc_digits or location or ""
+            if loc_display:
+                if kindle_link:
+                    parts.append(f"— location: [{loc_display}]({kindle_link}) ")
                 else:
-                    if kindle_link:
-                        f.write(f"— {kindle_link} ")
+                    parts.append(f"— location: [{loc_display}] ")
+            else:
+                if kindle_link:
+                    parts.append(f"— {kindle_link} ")
 
-                f.write(f"^ref-{ref_id}\n\n")
+            parts.append(f"^ref-{ref_id}\n\n")
 
-                # separator between highlights
-                f.write("---\n\n")
+            # separator between highlights
+            parts.append("---\n\n")
+
+        with open(output_filepath, "w", encoding="utf-8") as f:
+            f.write("".join(parts))
+
+    def _write_batch(items):
+        for item in items:
+            _write_book(item)
+
+    # books go to their own files, so the writes can overlap in threads;
+    # with only a handful of books the pool start-up is not worth it
+    workers = os.cpu_count() or 1
+    if len(groups) < workers * 2:
+        _write_batch(groups.items())
+    else:
+        # titles that sanitize to the same file name (or differ only in case,
+        # which collide on case-insensitive filesystems) are written by one
+        # thread in first-seen order, so the last one wins as in a serial run
+        batches = defaultdict(list)
+        for item in groups.items():
+            batches[sanitize_filename(item[0]).lower()].append(item)
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            list(ex.map(_write_batch, batches.values()))
     print(f"Exported highlights to {output_dir}")
 
 if __name__ == "__main__":
@@ -20,6 +20,7 @@ CSV の `highlights.csv` を読み込み、書名（Book）をキーにしてハ
 import csv
 import json
 from collections import defaultdict
+from itertools import groupby
 from pathlib import Path
 
 
@@ -27,38 +28,42 @@ CSV_PATH = Path(__file__).parent.parent / '_out' / 'highlights.csv'
 JSON_PATH = Path(__file__).parent.parent / '_out' / 'highlights.json'
 
 
-def normalize_cell(s):
-    if s is None:
-        return ''
-    return s.strip()
-
-
 def csv_to_grouped_json(csv_path: Path):
     grouped = defaultdict(list)
 
     # open with utf-8-sig to tolerate BOM
     with csv_path.open('r', encoding='utf-8-sig', newline='') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            book = normalize_cell(row.get('Book'))
+        reader = csv.reader(f)
+        # resolve the column positions once from the header
+        header = next(reader, None) or []
+        col_idx = {name: i for i, name in enumerate(header)}
+        bi = col_idx.get('Book')
+        hi = col_idx.get('Highlight')
+        ni = col_idx.get('Note')
+        if bi is None:
+            return grouped
+
+        # short rows: treat absent trailing cells as empty
+        def book_of(row):
+            return row[bi].strip() if bi < len(row) else ''
+
+        def content_of(row):
+            # use highlight text if present, otherwise fallback to note
+            highlight = row[hi].strip() if hi is not None and hi < len(row) else ''
+            return highlight or (row[ni].strip() if ni is not None and ni < len(row) else '')
+
+        # the scraper appends one book at a time, so rows come in runs of the
+        # same book; each run is collected in one go, and runs of a book that
+        # shows up again later (e.g. after a resumed scrape) are merged
+        for book, rows in groupby(reader, key=book_of):
             if not book:
                 # skip rows without a book title
                 continue
-
-            highlight = normalize_cell(row.get('Highlight'))
-            note = normalize_cell(row.get('Note'))
-            section = normalize_cell(row.get('Section'))
-            location = normalize_cell(row.get('Location'))
-
-            # use highlight text if present, otherwise fallback to note
-            content = highlight or note
-            if not content:
-                # nothing useful to store
-                continue
-
-            # minimal item: only 'h' (highlight text)
-            item = {'h': content}
-            grouped[book].append(item)
+            # minimal item: only 'h' (highlight text); rows with nothing
+            # useful to store are dropped
+            items = [{'h': content} for content in map(content_of, rows) if content]
+            if items:
+                grouped[book].extend(items)
 
     return grouped
 
@@ -70,14 +75,16 @@ def main():
 
     grouped = csv_to_grouped_json(CSV_PATH)
 
-    # Optionally sort books by title
-    out = {book: grouped[book] for book in sorted(grouped.keys())}
-
-    # write minified JSON (compact) with ensure_ascii=False for Japanese
-    with JSON_PATH.open('w', encoding='utf-8') as j:
-        json.dump(out, j, ensure_ascii=False, separators=(',',':'))
+    # write minified JSON (compact) with ensure_ascii=False for Japanese;
+    # books are sorted by title by sort_keys while encoding (no sorted copy
+    # of the dict), and dumps() takes the C encoder's one-shot path, so the
+    # whole document goes out in a single write
+    JSON_PATH.write_text(
+        json.dumps(grouped, ensure_ascii=False, separators=(',',':'), sort_keys=True),
+        encoding='utf-8',
+    )
 
-    print(f'Wrote {len(out)} books to {JSON_PATH}')
+    print(f'Wrote {len(grouped)} books to {JSON_PATH}')
     return 0
 
 
@@ -1,47 +1,175 @@
 import os
 import csv
-import time
 import requests
 from playwright.sync_api import sync_playwright
 from pathlib import Path
 
 ROOT = Path(__file__).parent.parent
 CSV_PATH = ROOT / '_out' / "books.csv"
-SESSION_FILE = ROOT / 'user_data' / 'my-kindle-scraper-session.json'
+# ブラウザのプロファイル（Cookie 等）。ハイライト取得スクリプトと同じディレクトリを使い、ログインを共有する
+USER_DATA_DIR = ROOT / 'user_data'
+# ログイン済みかの判定に使う Amazon の認証 Cookie
+LOGIN_COOKIE = "at-acbjp"
+LIBRARY_URL = "https://read.amazon.co.jp/kindle-library"
+# ログインの完了（一覧の最初のアイテムの描画）を待つ上限（ms）
+LOGIN_TIMEOUT_MS = 300000
+# 一覧のアイテム。描画されていれば一覧ページが表示されている
+LIBRARY_ITEM_SELECTOR = "ul#cover li[role='listitem']"
+# 出力ファイルの書き込みバッファ（bytes）。細い2列の CSV でも write の回数をまとめる
+WRITE_BUFFER_SIZE = 1 << 20
 DEBUG_HTML_PATH = ROOT / '_out' / 'my-kindle-scraper-debug.html'
+# 一覧スクロール: この時間（ms）新しい要素が追加されなければ末尾へスクロールし直す
+SCROLL_QUIET_MS = 1500
+# 上の待機が連続してこの回数続いたら全件読み込み済みとみなす（従来の「3回続けて件数が同じ」に相当。
+# 遅い読み込みや失敗した読み込みも、スクロールし直すことで再試行される）
+SCROLL_QUIET_ROUNDS = 3
+# 一覧スクロール全体の上限（ms）。従来の 200 ラウンド × 1.4 秒に相当
+SCROLL_MAX_MS = 280000
+# ブラウザから1回の evaluate で受け取る行数
+ROW_CHUNK_SIZE = 500
+# window.__kindleIter から次のまとまりを取り出す（取り尽くしたら null）
+NEXT_ROWS_JS = "() => { const r = window.__kindleIter.next(); return r.done ? null : r.value; }"
+# 抽出に使わないリソース種別（書名・著者はテキストのみで、表紙画像の中身は不要）
+BLOCKED_RESOURCE_TYPES = {"image", "font", "media"}
 
-def main():
-    with sync_playwright() as p:
-        browser = p.chromium.launch(headless=False)
-        viewport_size = {'width': 1920*2, 'height': 1080*2}
-        if os.path.exists(SESSION_FILE):
-            context = browser.new_context(storage_state=str(SESSION_FILE), viewport=viewport_size)
+def block_heavy_resources(context):
+    """画像・フォント・動画のリクエストを中断し、スクロール中の読み込みとデコードを省く。
+       ルーティングを有効にすると Playwright はブラウザの HTTP キャッシュを無効にするため、
+       この後の JS/CSS は毎回ネットワークから取得される（表紙画像を読まないことの方を優先している）
+    """
+    def _route(route):
+        if route.request.resource_type in BLOCKED_RESOURCE_TYPES:
+            route.abort()
         else:
-            context = browser.new_context(viewport=viewport_size)
+            route.continue_()
+    context.route("**/*", _route)
+
+def launch_context(p, headless):
+    """プロファイルを引き継いだ永続コンテキストを起動する（ログインの Cookie は実行をまたいで再利用される）"""
+    # 幅は 1280 に抑えて列数（横方向のレイアウト）を増やさず、高さは大きく取る。
+    # 面積は 1280x2400 の約3.3倍（約10 Mpx）になり1フレームの描画範囲は広がるが、
+    # 1回のスクロールで読み込まれる行が増えてスクロールの回数（読み込み待ちの回数）が減る方を優先する。
+    viewport_size = {'width': 1280, 'height': 8000}
+    args = ["--disable-gpu", "--disable-dev-shm-usage"] if headless else []
+    return p.chromium.launch_persistent_context(str(USER_DATA_DIR), headless=headless,
+                                                viewport=viewport_size, args=args)
+
+def is_logged_in(context):
+    """プロファイルに Amazon の認証 Cookie が残っているか"""
+    return any(c.get("name") == LOGIN_COOKIE for c in context.cookies(LIBRARY_URL))
+
+def open_library(context):
+    """コンテキストのページでライブラリの一覧を開く"""
+    page = context.pages[0] if context.pages else context.new_page()
+    page.goto(LIBRARY_URL)
+    return page
 
-        page = context.new_page()
-        page.goto("https://read.amazon.co.jp/kindle-library")
+def main():
+    with sync_playwright() as p:
+        # ログイン済みのプロファイルならログイン操作は不要なのでヘッドレスで実行する
+        context = launch_context(p, headless=True)
+        page = None
+        if is_logged_in(context):
+            block_heavy_resources(context)
+            page = open_library(context)
+            try:
+                # 一覧の最初のアイテムが描画されてからスクロールを始める
+                page.wait_for_selector(LIBRARY_ITEM_SELECTOR, timeout=60000)
+            except Exception:
+                # Cookie が残っていてもセッションが切れている（サインイン画面に送られた）場合は、ログインからやり直す
+                print("⚠️ ライブラリの一覧が表示されませんでした。ログインし直します")
+                page = None
 
-        if not os.path.exists(SESSION_FILE):
+        if page is None:
+            # ログインには画面が必要なため、ヘッドフルで開き直す
+            context.close()
+            context = launch_context(p, headless=False)
+            page = open_library(context)
             print("👉 Amazonにログインしてください...")
-            page.wait_for_load_state("networkidle")
-            time.sleep(30)
-            context.storage_state(path=str(SESSION_FILE))
-            print(f"✅ セッションを {SESSION_FILE} に保存しました")
+            try:
+                # 固定時間は待たず、ログインが終わって一覧が描画された時点で先へ進む
+                page.wait_for_selector(LIBRARY_ITEM_SELECTOR, timeout=LOGIN_TIMEOUT_MS)
+            except Exception:
+                # 待機に失敗しても処理を継続させる
+                pass
+            print(f"✅ ログイン情報はプロファイル {USER_DATA_DIR} に保存されます")
+            # ログイン画面（画像認証など）を壊さないよう、ブロックはログイン後に有効化する
+            block_heavy_resources(context)
 
-        # ページを下までスクロールして全件読み込み（アイテム数が増えなくなるまで待つ）
+        # ページを下までスクロールして全件読み込み（アイテムが追加されなくなるまで待つ）
         # ページ内でスクロール可能な親要素を探してそこをスクロールし、
-        # タイトルを持つ実アイテムの数が増えなくなるまで待つ（JS 実行）
-        scroll_js = r'''
-        () => {
-                const selector = 'ul#cover li[role="listitem"]';
-                const sleep = ms => new Promise(res => setTimeout(res, ms));
-
-                function countItems(){
-                    return Array.from(document.querySelectorAll(selector)).filter(li=>{
-                        const titleNode = li.querySelector('div[id^="title-"] p');
-                        return titleNode && titleNode.textContent.trim().length > 0;
-                    }).length;
+        # ul#cover への要素追加を MutationObserver で監視する。追加があるたびに末尾へスクロールし直し、
+        # SCROLL_QUIET_MS の間なにも追加されなければスクロールし直し、それが SCROLL_QUIET_ROUNDS 回
+        # 続いたら完了とみなす（固定のスリープでポーリングしない）。
+        # 完了したら書籍データを返すジェネレータ window.__kindleIter を用意し、
+        # 行は ROW_CHUNK_SIZE 件ずつ取り出して CSV に書く（全件を1回の巨大な応答で受け取らない）
+        scrape_js = r'''
+        ({quietMs, quietRounds, maxMs, chunkSize}) => {
+                // 空白の正規化。正規表現は1度だけ生成し、正規化が不要な文字列（大半の書名・著者名）は
+                // test だけで置換と trim を省く（先頭・末尾の空白、空白の連続、半角スペース以外の空白があれば置換する）
+                const WS = /\s+/g;
+                const NEEDS_NORM = /^\s|\s$|\s\s|[^\S ]/;
+                function norm(s){
+                    if (!s) return '';
+                    return NEEDS_NORM.test(s) ? s.replace(WS, ' ').trim() : s;
+                }
+                const itemSelector = 'li[role="listitem"]';
+                // タイトルを持つ実アイテムの数は、全件を数え直さず追加・変更のあった要素だけ見て増やす
+                const counted = new WeakSet();
+                let titled = 0;
+                // li 内の「id が prefix で始まる div」の最初の p を返す（div[id^="title-"] p と同じ対象）。
+                // 属性の前方一致セレクタを使わず、タグ名のコレクションを id で判定する
+                function fieldNode(li, prefix){
+                    const divs = li.getElementsByTagName('div');
+                    for (let i = 0; i < divs.length; i++) {
+                        if (!divs[i].id.startsWith(prefix)) continue;
+                        const p = divs[i].getElementsByTagName('p')[0];
+                        if (p) return p;
+                    }
+                    return null;
+                }
+
+                function noteItem(li){
+                    if (!li || counted.has(li)) return;
+                    const titleNode = fieldNode(li, 'title-');
+                    if (titleNode && titleNode.textContent.trim().length > 0) {
+                        counted.add(li);
+                        titled += 1;
+                    }
+                }
+
+                function listItems(){
+                    const ul = document.getElementById('cover');
+                    if (!ul) return [];
+                    // アイテムは通常 ul#cover の直下の li。直下に無い構造の場合だけセレクタで探す
+                    const items = Array.prototype.filter.call(ul.children, li => li.getAttribute('role') === 'listitem');
+                    return items.length ? items : Array.from(ul.querySelectorAll('li[role="listitem"]'));
+                }
+
+                // JSで書籍データを直接抽出。CSV の1行にそのまま使える [title, author] の配列で返す
+                // （キー名を含むオブジェクトや未使用の表紙 URL を転送しない）
+                function extractRows(items, start, end){
+                    const results = [];
+                    for (let i = start; i < end; i++) {
+                        const li = items[i];
+                        const titleNode = fieldNode(li, 'title-');
+                        const authorNode = fieldNode(li, 'author-');
+
+                        const title = norm(titleNode ? titleNode.textContent : "");
+                        const author = norm(authorNode ? authorNode.textContent : "");
+
+                        if (title) {
+                            results.push([title, author]);
+                        }
+                    }
+                    return results;
+                }
+                // 全件を1つの配列にせず、chunkSize 件ずつ行を返すジェネレータ（Python 側から next で取り出す）
+                function* iterRows(){
+                    const items = listItems();
+                    for (let i = 0; i < items.length; i += chunkSize) {
+                        yield extractRows(items, i, Math.min(i + chunkSize, items.length));
+                    }
                 }
 
                 function findScrollParent(el){
@@ -53,85 +181,132 @@ def main():
                     return window;
                 }
 
-                return new Promise(async (resolve) => {
+                return new Promise((resolve) => {
                     const list = document.querySelector('ul#cover');
-                    const scroller = list ? findScrollParent(list) : window;
-                    let prev = -1;
-                    let stable = 0;
-                    const maxRounds = 200;
-                    for (let i = 0; i < maxRounds; i++) {
-                        if (scroller === window) {
-                            window.scrollTo(0, document.body.scrollHeight);
-                        } else {
-                            scroller.scrollTo({ top: scroller.scrollHeight, behavior: 'auto' });
-                        }
-                        // 読み込み待ち
-                        await sleep(1000);
-                        const c = countItems();
-                        if (c !== prev) {
-                            prev = c;
-                            stable = 0;
-                        } else {
-                            stable += 1;
-                        }
-                        // 連続して同じ件数が3回続いたら完了とみなす（余裕を持たせる）
-                        if (stable >= 3) break;
-                        // 少しだけ追加待機して確実に読み込みを反映
-                        await sleep(400);
+                    // 一覧が無い（サインイン画面のまま等）場合は loaded: null で知らせる（Python 側は CSV を書き換えない）
+                    if (!list) { resolve({loaded: null}); return; }
+                    list.querySelectorAll(itemSelector).forEach(noteItem);
+                    const scroller = findScrollParent(list);
+                    let quietTimer = null;
+                    let capTimer = null;
+                    let observer = null;
+                    // 要素が追加されないまま過ぎた待機の回数（追加があれば 0 に戻す）
+                    let quiet = 0;
+
+                    let scrollPending = false;
+                    function scrollToEnd(){
+                        // 連続した変更はまとめて次のフレームで1回だけスクロールする
+                        // （レイアウトを確定させる scrollHeight の読み取りもフレームごとに1回で済む）
+                        if (scrollPending) return;
+                        scrollPending = true;
+                        requestAnimationFrame(() => {
+                            scrollPending = false;
+                            if (scroller === window) {
+                                window.scrollTo(0, document.body.scrollHeight);
+                            } else {
+                                // オプションオブジェクトを作らず scrollTop に直接書き込む
+                                scroller.scrollTop = scroller.scrollHeight;
+                            }
+                        });
                     }
-                    resolve(prev);
-                });
-            }
-        '''
-    
-        try:
-            page.evaluate(scroll_js)
-            page.wait_for_selector("ul#cover li[role='listitem']", timeout=60000)
-        except Exception:
-            # JS 実行や待機に失敗しても処理を継続させる
-            pass
-
-        # JSで書籍データを直接抽出
-        extract_js = r'''
-        () => {
-            function norm(s){ return (s||"").replace(/\s+/g,' ').trim(); }
-                const results = [];
-                const items = document.querySelectorAll('ul#cover li[role="listitem"]');
-                items.forEach(li => {
-                    const titleNode = li.querySelector('div[id^="title-"] p');
-                    const authorNode = li.querySelector('div[id^="author-"] p');
-                    const imgNode = li.querySelector('img[id^="cover-"]');
-
-                    const title = norm(titleNode ? titleNode.textContent : "");
-                    const author = norm(authorNode ? authorNode.textContent : "");
-                    const img = imgNode ? imgNode.src : "";
-
-                    if (title) {
-                        results.push({title, author, img});
+                    function finish(capped){
+                        observer.disconnect();
+                        clearTimeout(quietTimer);
+                        clearTimeout(capTimer);
+                        window.__kindleIter = iterRows();
+                        resolve({loaded: titled, capped});
+                    }
+                    function onQuiet(){
+                        quiet += 1;
+                        if (quiet >= quietRounds) { finish(false); return; }
+                        // 末尾にいるとスクロール位置が変わらず scroll イベントが出ないため、
+                        // 少し戻してから末尾へスクロールし直して次の読み込みを促す
+                        if (scroller === window) window.scrollBy(0, -1);
+                        else scroller.scrollTop -= 1;
+                        scrollToEnd();
+                        armQuietTimer();
                     }
+                    function armQuietTimer(){
+                        clearTimeout(quietTimer);
+                        quietTimer = setTimeout(onQuiet, quietMs);
+                    }
+
+                    observer = new MutationObserver(records => {
+                        for (const r of records) {
+                            // 既存アイテム内のタイトルが後から埋まった場合
+                            const target = r.target.nodeType === 1 ? r.target : r.target.parentElement;
+                            noteItem(target && target.closest(itemSelector));
+                            for (const n of r.addedNodes) {
+                                if (n.nodeType !== 1) continue;
+                                if (n.matches(itemSelector)) noteItem(n);
+                                else n.querySelectorAll(itemSelector).forEach(noteItem);
+                            }
+                        }
+                        quiet = 0;
+                        scrollToEnd();
+                        armQuietTimer();
+                    });
+                    observer.observe(list, { childList: true, subtree: true, characterData: true });
+                    // 読み込みが止まらない場合の上限
+                    capTimer = setTimeout(() => finish(true), maxMs);
+                    scrollToEnd();
+                    armQuietTimer();
                 });
-                return results;
             }
         '''
-        books = page.evaluate(extract_js)
-        print("✅ ブラウザ内で抽出した件数:", len(books))
-
-        with open(DEBUG_HTML_PATH, "w", encoding="utf-8") as f:
-            f.write(page.content())
-        browser.close()
-            
-    # CSV 書き込み
-    rows = []
-    for b in books:
-        title, author = b["title"], b["author"]
-        rows.append([title, author])
-
-    with open(CSV_PATH, "w", newline="", encoding="utf-8-sig") as f:
-        writer = csv.writer(f)
-        writer.writerow(["Title", "Author"])
-        writer.writerows(rows)
-
-    print(f"✅ 書籍一覧を {CSV_PATH} に保存しました（{len(rows)} 件）")
+
+        try:
+            res = page.evaluate(scrape_js, {"quietMs": SCROLL_QUIET_MS, "quietRounds": SCROLL_QUIET_ROUNDS,
+                                            "maxMs": SCROLL_MAX_MS, "chunkSize": ROW_CHUNK_SIZE})
+        except Exception as e:
+            # ページ遷移などで JS の実行に失敗しても処理を継続させる（既存の CSV は書き換えない）
+            print("⚠️ 一覧の読み込みに失敗しました:", e)
+            res = None
+
+        if res is not None and res.get("loaded") is None:
+            print("⚠️ ライブラリの一覧（ul#cover）が見つかりませんでした")
+            res = None
+
+        count = None
+        if res is not None:
+            print("✅ スクロールで読み込んだ件数:", res["loaded"])
+            if res.get("capped"):
+                print(f"⚠️ {SCROLL_MAX_MS // 1000} 秒以内に一覧の読み込みが終わらなかったため、途中までの件数で保存します")
+            # CSV 書き込み（各行は [title, author] なので、受け取ったまとまりをそのまま流し込む）。
+            # 一時ファイルに全件を書き終えてから置き換えるので、途中で失敗しても前回の CSV は残る
+            tmp_path = CSV_PATH.with_name(CSV_PATH.name + ".tmp")
+            count = 0
+            try:
+                with open(tmp_path, "w", newline="", encoding="utf-8-sig", buffering=WRITE_BUFFER_SIZE) as f:
+                    writer = csv.writer(f)
+                    writer.writerow(["Title", "Author"])
+                    while True:
+                        rows = page.evaluate(NEXT_ROWS_JS)
+                        if rows is None:
+                            break
+                        writer.writerows(rows)
+                        count += len(rows)
+                os.replace(tmp_path, CSV_PATH)
+                print("✅ ブラウザ内で抽出した件数:", count)
+            except Exception as e:
+                print("⚠️ 書籍データの受け取りに失敗しました:", e)
+                count = None
+            finally:
+                if tmp_path.exists():
+                    tmp_path.unlink()
+
+        # デバッグ用の HTML ダンプは KINDLE_DEBUG_DUMP=1 のときだけ書き出す
+        # （ページ全体ではなく、抽出対象の ul#cover だけを保存する）
+        if os.environ.get("KINDLE_DEBUG_DUMP") == "1":
+            cover_html = page.evaluate("document.getElementById('cover')?.outerHTML || ''")
+            with open(DEBUG_HTML_PATH, "w", encoding="utf-8", buffering=WRITE_BUFFER_SIZE) as f:
+                f.write(cover_html)
+        context.close()
+
+    if count is None:
+        print(f"⚠️ 書籍一覧を取得できなかったため、{CSV_PATH} は更新していません")
+    else:
+        print(f"✅ 書籍一覧を {CSV_PATH} に保存しました（{count} 件）")
 
 if __name__ == "__main__":
     main()
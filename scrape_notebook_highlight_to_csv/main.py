@@ -12,13 +12,32 @@ import os
 import re
 import time
 import unicodedata
+from urllib.parse import parse_qs, urlparse
 from dataclasses import dataclass
-from typing import List, Dict
+from functools import lru_cache
+from typing import List, Dict, Optional, Tuple
 from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeoutError
 
 BASE_URL = "https://read.amazon.co.jp/notebook/"
 USER_DATA_DIR = "user_data"
 DEFAULT_TIMEOUT = 20000  # ms
+RESPONSE_TIMEOUT = 5000  # ms: クリック後、注釈の取得レスポンスを待つ上限
+FSYNC_EVERY = 10  # 何冊ごとに出力 CSV をディスクへ同期するか
+OUTPUT_BUFFER_SIZE = 1 << 16  # 出力 CSV の書き込みバッファ（bytes）
+# 抽出に使わない静的リソース／計測系リクエスト（ブロック対象。Network.setBlockedURLs の * ワイルドカード形式。
+# 末尾の * はクエリ文字列付きの URL にも一致させるため）
+BLOCKED_URL_PATTERNS = [
+    *(f"*.{ext}*" for ext in ("png", "jpg", "jpeg", "gif", "webp", "svg", "ico", "woff", "ttf", "otf", "mp4")),
+    *(f"*{host}*" for host in ("googletagmanager", "doubleclick", "amazon-adsystem", "google-analytics")),
+]
+# 左一覧（"著者:" を含むアンカー）が表示されているかを判定する JS
+LIBRARY_PANE_JS = "() => Array.from(document.querySelectorAll('a')).some(a => (a.textContent||'').includes('著者:'))"
+
+# 書名の照合で毎回使う正規表現（モジュール読み込み時に一度だけコンパイル）
+_WS_RE = re.compile(r"\s+")
+_FULLW_WS_RE = re.compile(r"[\u3000\s]+")
+_BRACKETS_RE = re.compile(r"[“”\"'「」『』\(\)\[\]\s]+")
+_TOK_KEEP_RE = re.compile(r"[^\w\u3000-\u30FF\u4E00-\u9FFF- ]")
 
 
 @dataclass
@@ -30,8 +49,26 @@ class Highlight:
     note: str
     asin: str = ""
 
+@lru_cache(maxsize=4096)
+def _nfkc(s: str) -> str:
+    """NFKC 正規化（同じ書名は再試行のたびに正規化されるためメモ化する。上限付きで長時間の実行でも増え続けない）"""
+    return unicodedata.normalize("NFKC", s)
+
 def normalize_whitespace(s: str) -> str:
-    return re.sub(r"\s+", " ", (s or "")).strip()
+    return _WS_RE.sub(" ", (s or "")).strip()
+
+async def block_non_essential_resources(page) -> None:
+    """画像・フォント・動画・広告計測のリクエストをページ単位でブロックし、書籍ごとの読み込みを軽くする。
+       context.route はリクエストを横取りする間 HTTP キャッシュを無効にし、page.reload() や追加タブのたびに
+       JS/CSS を取り直すことになるため、横取りを伴わない CDP の Network.setBlockedURLs を使う（Chromium 専用）。
+    """
+    try:
+        cdp = await page.context.new_cdp_session(page)
+        await cdp.send("Network.enable")
+        await cdp.send("Network.setBlockedURLs", {"urls": BLOCKED_URL_PATTERNS})
+    except Exception:
+        # ブロックできなくても抽出自体はできるので続行する
+        pass
 
 async def get_candidate_titles(page) -> List[str]:
     """左の一覧に相当する 'a' タグのうち '著者:' を含むテキストを抽出し、書名部分のみ返す"""
@@ -40,185 +77,388 @@ async def get_candidate_titles(page) -> List[str]:
     except PlaywrightTimeoutError:
         return []
 
-    texts = await page.eval_on_selector_all(
+    # 書名部分の切り出しと重複除去もページ内で済ませ、結果の配列だけを受け取る
+    return await page.eval_on_selector_all(
         "a",
-        """els => els.map(e => (e.textContent||'').trim()).filter(t => t && t.includes('著者:'))"""
+        """els => {
+            const seen = new Set(); const out = [];
+            for (const e of els) {
+                const t = (e.textContent||'').trim();
+                if (!t.includes('著者:')) continue;
+                const left = t.split('著者:')[0].trim();
+                if (left && !seen.has(left)) { seen.add(left); out.push(left); }
+            }
+            return out;
+        }"""
     )
-    titles = []
-    for t in texts:
-        left = t.split("著者:")[0].strip()
-        if left:
-            titles.append(left)
-    seen = set(); uniq = []
-    for t in titles:
-        if t not in seen:
-            seen.add(t); uniq.append(t)
-    return uniq
 
-async def bring_into_view_by_scrolling(page, title: str) -> bool:
-    """ページ内の a タグを探し、見つかったら最も近いスクロール可能な祖先をスクロールして可視化する。
-       戻り値: 真=スクロールを試みた/見つけた、偽=見つからなかった
-    """
-    scroll_script = r'''
-    (title) => {
-      const anchors = Array.from(document.querySelectorAll('a'));
-      for (const el of anchors) {
+# 左一覧の 書名 → アンカー要素 の対応をページ内に一度だけ作る（window.__titleMap）。
+# リロードや遷移で window が作り直されると自動的に消えるため、その時だけ再構築される。
+# force が真なら既存の索引を捨てて作り直す（SPA が一覧を描画し直してアンカーが DOM から外れた場合）。
+TITLE_INDEX_FN = r'''
+function buildTitleIndex(force) {
+  if (!force && window.__titleMap && window.__titleMap.size) return window.__titleMap.size;
+  const m = new Map();
+  for (const a of document.querySelectorAll('a')) {
+    const t = (a.textContent || '').trim();
+    if (!t.includes('著者:')) continue;
+    const k = t.split('著者:')[0].trim();
+    if (k && !m.has(k)) m.set(k, a);
+  }
+  window.__titleMap = m;
+  return m.size;
+}
+'''
+
+# 索引から書名のアンカーを引く JS 関数。索引が無ければその場で作り（各ヘルパーの呼び出しだけで済み、
+# 事前に索引作成の evaluate を挟まない）、引いたアンカーが DOM から外れていれば索引を作り直して引き直す。
+# それでも索引にない場合のみ a タグを全件走査する
+FIND_TITLE_ANCHOR_FN = r'''
+function findTitleAnchor(title) {
+  buildTitleIndex(false);
+  let cached = window.__titleMap.get(title);
+  if (cached && !cached.isConnected) {
+    buildTitleIndex(true);
+    cached = window.__titleMap.get(title);
+  }
+  if (cached && cached.isConnected) return cached;
+  for (const a of document.querySelectorAll('a')) {
+    if ((a.textContent || '').includes(title)) return a;
+  }
+  return null;
+}
+'''
+
+# 現在表示されている書籍の ASIN とハイライトを抽出する JS（window.__kindleExtract として登録）
+EXTRACT_ANNOTATIONS_JS = r'''
+() => {
+    function norm(s){ return (s||"").replace(/\s+/g,' ').trim(); }
+    const container = document.querySelector('div.kp-notebook-annotation-container') || document.body;
+    const nodes = Array.from(container.querySelectorAll('.kp-notebook-annotation, .kp-notebook-highlight, li'));
+    // メタデータ要素（#annotationHighlightHeader / .kp-notebook-metadata）は一度だけ取得し、位置も先に解析しておく
+    const metas = Array.from(document.querySelectorAll('#annotationHighlightHeader, .kp-notebook-metadata')).map(m => {
+        const locM = norm(m.innerText || m.textContent || "").match(/(位置|Location|Loc|ページ|Page)[:：\s]*([0-9\-–,]+)/i);
+        return {el: m, loc: locM ? locM[2].trim() : ""};
+    });
+    const results = [];
+    // nodes と metas はどちらも文書順なので、2つの添字を同時に進めて
+    // 各ノードに「ノード内の最初の位置付きメタ、なければ直前にある位置付きメタ」を割り当てる。
+    // 添字はノードより前にあるメタだけで進める（li などの外側のノードが後続ノードのメタまで含んでいても、
+    // それらを消費しない）
+    let mi = 0;
+    let lastLoc = "";
+    nodes.forEach(n => {
+        while (mi < metas.length && (n.compareDocumentPosition(metas[mi].el) & Node.DOCUMENT_POSITION_PRECEDING)) {
+            if (metas[mi].loc) lastLoc = metas[mi].loc;
+            mi++;
+        }
+        // ノード内のメタは添字の直後に連続して並ぶので、そこだけをノードごとに見る
+        let ownLoc = "";
+        for (let j = mi; j < metas.length && n.contains(metas[j].el); j++) {
+            if (metas[j].loc) { ownLoc = metas[j].loc; break; }
+        }
         try {
-          if (!el || !(el.textContent || '').includes(title)) continue;
-          // 見つけたら最も近いスクロール可能な祖先を探す
-          let anc = el.parentElement;
-          while (anc && anc !== document.body) {
-            const style = window.getComputedStyle(anc);
-            const overflowY = (style.overflowY || style.overflow || '').toLowerCase();
-            if (overflowY === 'auto' || overflowY === 'scroll' || anc.scrollHeight > anc.clientHeight) {
-              // スクロールして要素を中央付近に持ってくる
-              const offset = el.offsetTop - Math.floor(anc.clientHeight / 2);
-              anc.scrollTop = offset > 0 ? offset : 0;
-              return true;
+            const full = norm(n.innerText || "");
+            if (!full || full.length < 1) return;
+
+            let location = ownLoc || lastLoc;
+
+            // 最終フォールバック: ノード自身のテキストに位置情報が含まれているか確認
+            if (!location) {
+                const locM2 = full.match(/(位置|Location|Loc|ページ|Page)[:：\s]*([^\n|\|]+)/i);
+                if (locM2) location = locM2[2].trim();
             }
-            anc = anc.parentElement;
-          }
-          // フォールバック: 要素自身を中央にスクロール
-          el.scrollIntoView({behavior:'auto', block:'center', inline:'nearest'});
-          return true;
+
+            // 位置文字列を正規化して数値部分のみを取り出す（例: '位置: 114' -> '114'）
+            try {
+                if (location) {
+                    // remove non-numeric leading/trailing characters except range/delimiters
+                    const m = location.match(/([0-9]+(?:[\-–,][0-9]+)*)/);
+                    if (m) location = m[1]; else location = location.replace(/[^0-9\-–,]/g,'').trim();
+                }
+            } catch (e) {
+                // ignore
+            }
+
+            // メモ（Note）抽出
+            const noteM = full.match(/(Note|メモ|注釈)[:：\s]*([^\n]+)/i);
+            const note = noteM ? noteM[2].trim() : "";
+
+            // セクション見出しを祖先（自身を含む）から取得。祖先の走査はブラウザ側の closest に任せる
+            const heading = n.closest('h1, h2, h3, h4, h5, h6');
+            const section = heading ? norm(heading.innerText) : "";
+
+            // ハイライト本文は full から位置・メモ表記を取り除く
+            let highlight = full;
+            if (location) highlight = highlight.replace(location, "");
+            if (note) highlight = highlight.replace(note, "");
+            highlight = highlight.replace(/(位置|Location|Loc|ページ|Page)[:：]*/ig, '');
+            highlight = highlight.replace(/(Note|メモ|注釈)[:：]*/ig, '');
+            highlight = highlight.replace(/\|/g,' ');
+            highlight = highlight.replace(/\s+/g,' ').trim();
+
+            results.push({section, location, highlight, note});
         } catch (e) {
-          continue;
+            // 個別要素の解析失敗は無視
+        }
+    });
+    const seen = new Set();
+    const uniq = [];
+    for (const r of results) {
+        const key = (r.highlight||"").slice(0,300);
+        if (!key || seen.has(key)) continue;
+        seen.add(key);
+        uniq.push(r);
+    }
+    // ページ内の hidden ASIN 要素も同じ呼び出しで読む
+    const asinEl = document.querySelector('#kp-notebook-annotations-asin');
+    return {asin: asinEl ? (asinEl.getAttribute('value') || "") : "", items: uniq};
+}
+'''
+
+# ページ内で使う関数群をまとめて window に登録する JS。context.add_init_script で文書ごとに一度だけ実行され、
+# 書籍ごとの呼び出しでは関数名と引数だけを送る（大きな JS を毎回送信・パースしない）
+PAGE_HELPERS_INIT_JS = r'''
+(() => {
+  if (window.__kindleExtract) return;
+  ''' + TITLE_INDEX_FN.strip() + r'''
+  ''' + FIND_TITLE_ANCHOR_FN.strip() + r'''
+  window.__kindleScrollTo = function (title) {
+    const el = findTitleAnchor(title);
+    if (!el) return false;
+    try {
+      // 見つけたら最も近いスクロール可能な祖先を探す
+      let anc = el.parentElement;
+      while (anc && anc !== document.body) {
+        const style = window.getComputedStyle(anc);
+        const overflowY = (style.overflowY || style.overflow || '').toLowerCase();
+        if (overflowY === 'auto' || overflowY === 'scroll' || anc.scrollHeight > anc.clientHeight) {
+          // スクロールして要素を中央付近に持ってくる
+          const offset = el.offsetTop - Math.floor(anc.clientHeight / 2);
+          anc.scrollTop = offset > 0 ? offset : 0;
+          return true;
         }
+        anc = anc.parentElement;
       }
+      // フォールバック: 要素自身を中央にスクロール
+      el.scrollIntoView({behavior:'auto', block:'center', inline:'nearest'});
+      return true;
+    } catch (e) {
       return false;
     }
-    '''
+  };
+  // 書名のアンカーが属する左一覧の行から書籍の ASIN を読む（分からなければ空文字）
+  window.__kindleTitleAsin = function (title) {
+    const el = findTitleAnchor(title);
+    if (!el) return '';
+    const holder = el.closest('[data-get-annotations-for-asin]');
+    if (holder) {
+      try {
+        const a = JSON.parse(holder.getAttribute('data-get-annotations-for-asin')).asin;
+        if (a) return String(a).trim();
+      } catch (e) {
+        // 属性の形式が違えば行の id を使う
+      }
+    }
+    const row = el.closest('.kp-notebook-library-each-book');
+    return row && row.id ? row.id.trim() : '';
+  };
+  window.__kindleClickTitle = function (title) {
+    const el = findTitleAnchor(title);
+    if (!el) return false;
+    el.click();
+    return true;
+  };
+  window.__kindleExtract = ''' + EXTRACT_ANNOTATIONS_JS.strip() + r''';
+})();
+'''
+
+# 登録済みのページ内関数を呼ぶ JS（未登録なら defined: false を返す）
+PAGE_HELPER_CALL_JS = "([name, args]) => typeof window[name] === 'function' ? {defined: true, value: window[name](...args)} : {defined: false}"
+
+async def call_page_helper(page, name: str, *args):
+    """PAGE_HELPERS_INIT_JS で登録したページ内関数を呼んで結果を返す。
+       init script 登録前から開いていた文書などで未定義の場合のみ、その場で登録してから呼び直す。
+    """
+    res = await page.evaluate(PAGE_HELPER_CALL_JS, [name, list(args)])
+    if not res.get("defined"):
+        await page.evaluate(PAGE_HELPERS_INIT_JS)
+        res = await page.evaluate(PAGE_HELPER_CALL_JS, [name, list(args)])
+    return res.get("value")
+
+async def title_asin(page, title: str) -> str:
+    """左一覧で書名のアンカーが属する行から書籍の ASIN を返す（分からなければ空文字）"""
     try:
-        return await page.evaluate(scroll_script, title)
+        return (await call_page_helper(page, "__kindleTitleAsin", title)) or ""
     except Exception:
-        return False
+        return ""
 
-async def click_book_by_title(page, title: str) -> bool:
-    """スクロール→可視化→クリックの一連を実行。成功したら True を返す。"""
-    attempts = 10
-    for attempt in range(attempts):
-        # 1) スクロールで可視化を試みる（スクロール可能祖先を調整）
-        _ = await bring_into_view_by_scrolling(page, title)
-        await asyncio.sleep(1)  # アニメーションや差分読み込みの猶予
+async def bring_into_view_by_scrolling(page, title: str) -> bool:
+    """索引から a タグを引き、見つかったら最も近いスクロール可能な祖先をスクロールして可視化する。
+       戻り値: 真=スクロールを試みた/見つけた、偽=見つからなかった
+    """
+    try:
+        return bool(await call_page_helper(page, "__kindleScrollTo", title))
+    except Exception:
+        return False
 
-        # 2) Playwright 側でも要素を視界内にする（二重保証）
-        try:
-            anchors = page.locator("a", has_text=title)
-            count = await anchors.count()
-            # 優先：表示されている要素を探してクリック
-            for i in range(count):
-                el = anchors.nth(i)
-                if await el.is_visible():
-                    try:
-                        await el.scroll_into_view_if_needed()
-                        await asyncio.sleep(0.12)
-                        await el.click(timeout=8000)
-                        return True
-                    except Exception:
-                        # 個別にクリックできない場合は次へ
-                        continue
-            # 表示されていないが候補がある場合は最初の候補をスクロールしてクリックを試す
-            if count > 0:
-                el = anchors.first
-                try:
-                    await el.scroll_into_view_if_needed()
-                    await asyncio.sleep(0.12)
-                    await el.click(timeout=8000)
-                    return True
-                except Exception:
-                    # 再試行ループへ
-                    await asyncio.sleep(0.4)
-                    continue
-            # フォールバック: 部分一致のテキスト検索
-            others = page.get_by_text(title, exact=False)
-            other_count = await others.count()
-            for i in range(other_count):
-                el = others.nth(i)
-                try:
-                    await el.scroll_into_view_if_needed()
-                    await asyncio.sleep(0.12)
-                    await el.click(timeout=8000)
-                    return True
-                except Exception:
-                    continue
-        except Exception:
-            pass
+async def click_indexed_title(page, title: str) -> bool:
+    """索引から書名のアンカーを引いてページ内で直接クリックする。見つからなければ False"""
+    try:
+        return bool(await call_page_helper(page, "__kindleClickTitle", title))
+    except Exception:
+        return False
 
-        # 少し待って再試行
-        await asyncio.sleep(0.6)
-    return False
+def is_annotations_response(response) -> bool:
+    """書籍クリック時に発行される注釈一覧の取得レスポンス（/notebook?asin=...）かを判定する"""
+    url = response.url
+    return "/notebook" in url and "asin=" in url
 
+def annotations_asin(response) -> str:
+    """注釈一覧の取得レスポンスの URL から ASIN を取り出す（無ければ空文字）"""
+    try:
+        return parse_qs(urlparse(response.url).query).get("asin", [""])[0].strip()
+    except Exception:
+        return ""
+
+async def _click_title_once(page, title: str) -> bool:
+    """書名のアンカーを可視化して一度だけクリックする。クリックできなければ False"""
+    await bring_into_view_by_scrolling(page, title)
+    # 索引済みのアンカーをページ内で直接クリック（a タグの再走査を伴わない）
+    if await click_indexed_title(page, title):
+        return True
+    try:
+        await page.locator("a", has_text=title).first.click(timeout=5000)
+        return True
+    except Exception:
+        return False
 
-async def safe_click_and_wait(page, title, click_fn, wait_fn, timeout=20000, max_reloads=2):
-    """
-    安全にクリックしてコンテキスト出現を待つヘルパー。
-    - click_fn(page, title) -> bool: クリック処理
-    - wait_fn(page, title, timeout=...) -> bool: コンテキスト検出
-    - コンソールに KPUtils / srsBaseHref 等のエラーが出たら reload -> 再試行する
+async def click_book_by_title(page, title: str) -> Optional[str]:
+    """スクロール→可視化→クリックを行い、注釈の取得レスポンスを待つ。
+       表示されるはずの書籍の ASIN を返し、表示の確認は呼び出し側（wait_fn）が hidden ASIN で行う。
+       クリックできない場合や、レスポンスが来ず一覧からも ASIN が分からない場合は None を返す
+       （表示が切り替わった保証がないため）。固定のスリープは使わず、リロードと再試行は呼び出し側に任せる。
     """
-    for attempt in range(max_reloads + 1):
-        error_count = 0
+    clicked = False
+    # クリックする書籍の ASIN が分かれば、その書籍のレスポンスだけを待つ
+    # （リロード直後の読み込みなど、別の書籍の注釈レスポンスを取り違えない）
+    expected = await title_asin(page, title)
 
-        # コンソールメッセージを監視して特定のエラー文字列をカウントする
-        def _on_console(msg):
-            nonlocal error_count
-            try:
-                # Playwright ConsoleMessage: use type and text()
-                mtype = msg.type
-                txt = msg.text if hasattr(msg, 'text') else msg.text()
-                if mtype == "error":
-                    if ("srsBaseHref" in txt) or ("KPUtils" in txt) or ("KPUtils.min.js" in txt):
-                        error_count += 1
-            except Exception:
-                pass
+    def _is_expected(response):
+        return is_annotations_response(response) and (not expected or annotations_asin(response) == expected)
 
-        # attach handler
+    try:
+        async with page.expect_response(_is_expected, timeout=RESPONSE_TIMEOUT) as resp_info:
+            clicked = await _click_title_once(page, title)
+            if not clicked:
+                raise LookupError(title)
+        asin = annotations_asin(await resp_info.value)
+        # 一覧から ASIN を読めずレスポンスを照合できなかった場合だけ、表示の切り替わり後に書名も確認する
+        if asin and (expected or await wait_for_book_context(page, title, asin=asin, confirm_title=True)):
+            return asin
+    except PlaywrightTimeoutError:
+        # 表示中の書籍を再クリックした場合などはレスポンスが発生しない。
+        # クリックした書籍の ASIN が分かっていれば、それが表示されているかを wait_fn に確認させる
+        if clicked and expected:
+            return expected
+    except Exception:
+        pass
+    return None
+
+
+def console_error_listener(error_state: Dict[str, int]):
+    """コンソールに KPUtils / srsBaseHref 等のエラーが出たら error_state["count"] を増やすリスナーを返す"""
+    def _on_console(msg):
         try:
-            page.on("console", _on_console)
+            # Playwright ConsoleMessage: use type and text()
+            mtype = msg.type
+            txt = msg.text if hasattr(msg, 'text') else msg.text()
+            if mtype == "error":
+                if ("srsBaseHref" in txt) or ("KPUtils" in txt) or ("KPUtils.min.js" in txt):
+                    error_state["count"] += 1
         except Exception:
-            # 一部の環境では page.on の挙動が異なる可能性があるため黙って続行
             pass
+    return _on_console
 
-        ok = False
+def watch_console_errors(page) -> Dict[str, int]:
+    """
+    コンソールに KPUtils / srsBaseHref 等のエラーが出た回数を数えるリスナーをページに一度だけ登録する。
+    返す dict の "count" を safe_click_and_wait が試行ごとに 0 に戻して参照する。
+    """
+    error_state = {"count": 0}
+    try:
+        page.on("console", console_error_listener(error_state))
+    except Exception:
+        # 一部の環境では page.on の挙動が異なる可能性があるため黙って続行
+        pass
+    return error_state
+
+async def safe_click_and_wait(page, title, click_fn, wait_fn, timeout=20000, max_reloads=2, error_state=None):
+    """
+    安全にクリックしてコンテキスト出現を待つヘルパー。
+    - click_fn(page, title) -> Optional[str]: クリック処理（表示されるはずの書籍の ASIN、失敗なら None）
+    - wait_fn(page, title, timeout=..., asin=...) -> bool: コンテキスト検出
+    - error_state: watch_console_errors(page) の戻り値（省略時はこの呼び出しの間だけ一時的に監視する）
+    - コンソールに KPUtils / srsBaseHref 等のエラーが出たら reload -> 再試行する
+    """
+    temp_listener = None
+    if error_state is None:
+        # 呼び出し側が監視していない場合は、この呼び出しの間だけリスナーを登録し、終わったら外す
+        error_state = {"count": 0}
+        temp_listener = console_error_listener(error_state)
         try:
-            ok = await click_fn(page, title)
+            page.on("console", temp_listener)
         except Exception:
-            ok = False
+            temp_listener = None
+    try:
+        for attempt in range(max_reloads + 1):
+            # この試行中に出たエラーだけを数える
+            error_state["count"] = 0
 
-        # クリック自体に失敗したらリロードしてリトライ
-        if not ok:
+            asin = None
             try:
-                await page.reload()
+                asin = await click_fn(page, title)
+            except Exception:
+                asin = None
+
+            # クリック自体に失敗したらリロードしてリトライ（リロードの方針はこの関数だけが持つ）
+            if not asin:
                 try:
-                    await page.wait_for_selector("a", timeout=16000)
+                    await page.reload()
+                    try:
+                        await page.wait_for_selector("a", timeout=16000)
+                    except Exception:
+                        await asyncio.sleep(1.0)
                 except Exception:
                     await asyncio.sleep(1.0)
-            except Exception:
-                await asyncio.sleep(1.0)
+                continue
+
+            # クリック成功後にコンテキストが出るか待つ（短めの総合待機）
+            ctx_ok = False
             try:
-                page.off("console", _on_console)
+                # wait_fn は内部で待機するため、ここでは全体タイムアウトだけ保証
+                ctx_ok = await asyncio.wait_for(wait_fn(page, title, timeout=min(timeout, 15000), asin=asin), timeout=20)
+            except asyncio.TimeoutError:
+                ctx_ok = False
             except Exception:
-                pass
-            continue
+                ctx_ok = False
 
-        # クリック成功後にコンテキストが出るか待つ（短めの総合待機）
-        ctx_ok = False
-        try:
-            # wait_fn は内部で待機するため、ここでは全体タイムアウトだけ保証
-            ctx_ok = await asyncio.wait_for(wait_fn(page, title, timeout=min(timeout, 15000)), timeout=20)
-        except asyncio.TimeoutError:
-            ctx_ok = False
-        except Exception:
-            ctx_ok = False
+            # コンソールエラーが発生していたらリロードして再試行
+            if error_state["count"] > 0:
+                try:
+                    await page.reload()
+                    try:
+                        await page.wait_for_selector("a", timeout=8000)
+                    except Exception:
+                        await asyncio.sleep(1.0)
+                except Exception:
+                    await asyncio.sleep(1.0)
+                continue
 
-        # detach handler
-        try:
-            page.off("console", _on_console)
-        except Exception:
-            pass
+            if ctx_ok:
+                return True
 
-        # コンソールエラーが発生していたらリロードして再試行
-        if error_count > 0:
+            # コンテキストが得られなかった場合もリロードして再試行
             try:
                 await page.reload()
                 try:
@@ -227,40 +467,121 @@ async def safe_click_and_wait(page, title, click_fn, wait_fn, timeout=20000, max
                     await asyncio.sleep(1.0)
             except Exception:
                 await asyncio.sleep(1.0)
-            continue
-
-        if ctx_ok:
-            return True
 
-        # コンテキストが得られなかった場合もリロードして再試行
-        try:
-            await page.reload()
+        return False
+    finally:
+        if temp_listener is not None:
             try:
-                await page.wait_for_selector("a", timeout=8000)
+                page.remove_listener("console", temp_listener)
             except Exception:
-                await asyncio.sleep(1.0)
-        except Exception:
-            await asyncio.sleep(1.0)
+                pass
 
-    return False
+# 表示中の書籍の hidden ASIN が指定の値になったかを判定する JS（wait_for_function 用）
+SHOWN_ASIN_JS = "asin => { const e = document.querySelector('#kp-notebook-annotations-asin'); return !!e && (e.getAttribute('value') || '').trim() === asin; }"
+
+# 書籍コンテキストの見出し候補（h1/h2/h3 と Kindle 固有クラス）
+BOOK_HEADER_SELECTORS = [
+    "div.kp-notebook-header", "h1", "h2", "h3",
+    ".kp-notebook-metadata", ".kp-notebook-metadata h3",
+    ".kp-notebook-print-override", ".kp-notebook-header h2",
+    ".kp-notebook-viewer h1", ".kp-notebook-title",
+    "h3.kp-notebook-selectable", ".a-spacing-top-small h3"
+]
+
+# クリックした書籍が表示されているかを1回の evaluate で判定する JS。
+# 正規化は wait_for_book_context 内の norm / token_list と同じ規則を JS に移したもの。
+# 戻り値: {ok: bool, reason: 判定に使った根拠}
+BOOK_CONTEXT_CHECK_JS = r'''
+({title, toks, threshold, selectors}) => {
+    function norm(s) {
+        if (!s) return "";
+        s = s.normalize('NFKC');
+        s = s.replace(/[\u3000\s]+/g, ' ');  // 全角スペース含めて圧縮
+        s = s.replace(/[“”"'「」『』()\[\]\s]+/g, ' ');
+        return s.trim();
+    }
+    function tokenList(s) {
+        // 英数＋日本語ブロックを残す
+        const s2 = s.replace(/[^\p{L}\p{N}_\u3000-\u30FF\u4E00-\u9FFF\- ]/gu, ' ');
+        return s2.split(/\s+/).filter(t => t.length >= 2);
+    }
+    const titleSet = new Set(toks);
+    function matches(t) {
+        // 直接部分一致
+        if (title && (t.includes(title) || title.includes(t))) return true;
+        if (!toks.length) return false;
+        // トークン一致（閾値: タイトルトークンの半分以上が表示内に含まれる）
+        const got = tokenList(t);
+        // 完全一致は集合で数え、足りない場合のみ部分一致で数え直す
+        let exact = 0;
+        for (const g of new Set(got)) if (titleSet.has(g)) exact++;
+        if (exact >= threshold) return true;
+        let common = 0;
+        for (const tok of toks) if (got.some(g => g.includes(tok))) common++;
+        return common >= threshold;
+    }
+
+    // 1) document.title
+    const ptitle = norm(document.title);
+    if (title && (ptitle.includes(title) || title.includes(ptitle))) return {ok: true, reason: 'title'};
+
+    // 2) 見出し系セレクタ（各セレクタ先頭 8 要素まで）
+    for (const sel of selectors) {
+        let els;
+        try { els = document.querySelectorAll(sel); } catch (e) { continue; }
+        for (let i = 0; i < Math.min(els.length, 8); i++) {
+            const t = norm(els[i].innerText || "");
+            if (t && matches(t)) return {ok: true, reason: 'header:' + sel};
+        }
+    }
+
+    // 3) body 全文（範囲を広げる）
+    const body = norm(document.body ? document.body.innerText : "");
+    if (title && (body.includes(title) || toks.some(tok => body.includes(tok)))) return {ok: true, reason: 'body'};
+
+    // 4) hidden ASIN があり、ハイライト要素も表示されていれば OK（UI上は注釈が見えている）
+    const asinEl = document.querySelector('#kp-notebook-annotations-asin');
+    if (asinEl && asinEl.getAttribute('value')
+        && document.querySelector('div.kp-notebook-annotation-container .kp-notebook-highlight, .kp-notebook-highlight')) {
+        return {ok: true, reason: 'asin'};
+    }
+    return {ok: false, reason: ''};
+}
+'''
+
+async def wait_for_book_context(page, title: str, timeout=20000, asin: str = "", confirm_title: bool = False) -> bool:
+    """クリック後、対象書籍のコンテキスト（ヘッダ等）が表示されたかを検証する。
+       asin（click_book_by_title が返した、表示されるはずの書籍の ASIN）があれば、ページの hidden ASIN が
+       それに切り替わったことだけで判定し、切り替わらなければ失敗とする。
+       confirm_title が真なら、切り替わった後に見出し等のヒューリスティックで書名も確認する。
+    """
+    if asin:
+        try:
+            await page.wait_for_function(SHOWN_ASIN_JS, arg=asin, timeout=min(timeout, 8000))
+        except Exception:
+            # hidden ASIN が切り替わらなければ、前の書籍の表示が残っているので失敗とする
+            # （見出し等のヒューリスティックは前の書籍でも通ってしまうため使わない）
+            return False
+        if not confirm_title:
+            return True
 
-async def wait_for_book_context(page, title: str, timeout=20000) -> bool:
-    """クリック後、対象書籍のコンテキスト（ヘッダ等）が表示されたかを検証する"""
     def norm(s: str) -> str:
         if not s:
             return ""
-        s = unicodedata.normalize("NFKC", s)
-        s = re.sub(r"[\u3000\s]+", " ", s)  # 全角スペース含めて圧縮
-        s = re.sub(r"[“”\"'「」『』\(\)\[\]\s]+", " ", s)
+        s = _nfkc(s)
+        s = _FULLW_WS_RE.sub(" ", s)  # 全角スペース含めて圧縮
+        s = _BRACKETS_RE.sub(" ", s)
         return s.strip()
 
     def token_list(s: str):
-        s2 = re.sub(r"[^\w\u3000-\u30FF\u4E00-\u9FFF- ]", " ", s)  # 英数＋日本語ブロックを残す
-        toks = [t for t in re.split(r"\s+", s2) if len(t) >= 2]
+        s2 = _TOK_KEEP_RE.sub(" ", s)  # 英数＋日本語ブロックを残す
+        toks = [t for t in _WS_RE.split(s2) if len(t) >= 2]
         return toks
 
     n_title = norm(title or "")
     title_toks = token_list(n_title)
+    # トークン一致の閾値は書名ごとに一度だけ計算する
+    tok_threshold = max(1, (len(title_toks) + 1) // 2)
 
     # まずは注釈コンテナかハイライトが出るまで短く待つ（SPA の遅延対処）
     try:
@@ -269,228 +590,123 @@ async def wait_for_book_context(page, title: str, timeout=20000) -> bool:
         # 続行して別手段で判定
         pass
 
-    # 1) document.title / page.title()
-    try:
-        ptitle = norm(await page.title())
-        if n_title and (n_title in ptitle or ptitle in n_title):
-            return True
-    except Exception:
-        pass
-
-    # 2) 見出し系セレクタを拡充（h1/h2/h3 と Kindle 固有クラス）
-    header_selectors = [
-        "div.kp-notebook-header", "h1", "h2", "h3",
-        ".kp-notebook-metadata", ".kp-notebook-metadata h3",
-        ".kp-notebook-print-override", ".kp-notebook-header h2",
-        ".kp-notebook-viewer h1", ".kp-notebook-title",
-        "h3.kp-notebook-selectable", ".a-spacing-top-small h3"
-    ]
-    for hs in header_selectors:
-        try:
-            loc = page.locator(hs)
-            cnt = await loc.count()
-            for i in range(min(cnt, 8)):
-                try:
-                    raw = await loc.nth(i).inner_text()
-                except Exception:
-                    continue
-                t = norm(raw)
-                if not t:
-                    continue
-                # 直接部分一致
-                if n_title and (n_title in t or t in n_title):
-                    return True
-                # トークン一致（閾値: タイトルトークンの半分以上が表示内に含まれる）
-                if title_toks:
-                    got_toks = token_list(t)
-                    common = sum(1 for tok in title_toks if any(tok in g for g in got_toks))
-                    if common >= max(1, (len(title_toks) + 1) // 2):
-                        return True
-        except Exception:
-            continue
-
-    # 3) body 全文（範囲を広げる）
+    # 1)〜4) の判定はページ内 JS でまとめて行い、ブラウザとの往復を1回にする
     try:
-        body_text = norm(await page.locator("body").inner_text())
-        if n_title and (n_title in body_text or any(tok in body_text for tok in title_toks)):
+        res = await page.evaluate(BOOK_CONTEXT_CHECK_JS, {
+            "title": n_title,
+            "toks": title_toks,
+            "threshold": tok_threshold,
+            "selectors": BOOK_HEADER_SELECTORS,
+        })
+        if res and res.get("ok"):
             return True
     except Exception:
         pass
 
-    # 4) ハイライト一覧や hidden ASIN があるなら OK（UI上は注釈が見えている）
-    try:
-        asin = await page.locator("#kp-notebook-annotations-asin").get_attribute("value")
-        if asin:
-            # 少なくとも注釈コンテナ内にハイライト要素があれば OK と見なす
-            try:
-                cnt = await page.locator("div.kp-notebook-annotation-container .kp-notebook-highlight, .kp-notebook-highlight").count()
-                if cnt and cnt > 0:
-                    return True
-            except Exception:
-                return True
-    except Exception:
-        pass
-
     # 5) デバッグ用（必要なら有効化）
     # await page.screenshot(path=f"debug_fail_{int(time.time())}.png")
     # html = await page.content(); open('debug_fail.html','w',encoding='utf-8').write(html)
 
     return False
 
-async def extract_annotations_for_current_book(page) -> List[Dict]:
-        """現在表示されている書籍のハイライトをページ内 JS で抽出して返す"""
-
-        extract_js = r'''
-        () => {
-            function norm(s){ return (s||"").replace(/\s+/g,' ').trim(); }
-            const container = document.querySelector('div.kp-notebook-annotation-container') || document.body;
-            const nodeList = container.querySelectorAll('.kp-notebook-annotation, .kp-notebook-highlight, li');
-            const results = [];
-            nodeList.forEach(n => {
-                try {
-                    const full = norm(n.innerText || "");
-                    if (!full || full.length < 1) return;
-
-                                // 近傍のメタデータ要素から位置情報を探す（例: #annotationHighlightHeader や .kp-notebook-metadata）
-                                let location = "";
-                                try {
-                                    // 1) 祖先ノード内を検索
-                                    let anc2 = n;
-                                    while (anc2 && anc2 !== document && anc2 !== document.body) {
-                                        if (anc2.querySelector) {
-                                            const meta = anc2.querySelector('#annotationHighlightHeader, .kp-notebook-metadata');
-                                            if (meta && meta.innerText) {
-                                                const mm = norm(meta.innerText);
-                                                const locM = mm.match(/(位置|Location|Loc|ページ|Page)[:：\s]*([0-9\-–,]+)/i);
-                                                if (locM) { location = locM[2].trim(); break; }
-                                            }
-                                        }
-                                        anc2 = anc2.parentElement;
-                                    }
-
-                                    // 2) 前方の兄弟要素に metadata があるか探す
-                                    if (!location) {
-                                        let sib = n.previousElementSibling;
-                                        while (sib) {
-                                            if ((sib.id && sib.id === 'annotationHighlightHeader') || (sib.classList && sib.classList.contains('kp-notebook-metadata'))) {
-                                                const mm = norm(sib.innerText || sib.textContent || "");
-                                                const locM = mm.match(/(位置|Location|Loc|ページ|Page)[:：\s]*([0-9\-–,]+)/i);
-                                                if (locM) { location = locM[2].trim(); break; }
-                                            }
-                                            if (sib.querySelector) {
-                                                const inside = sib.querySelector('#annotationHighlightHeader, .kp-notebook-metadata');
-                                                if (inside && inside.innerText) {
-                                                    const mm = norm(inside.innerText);
-                                                    const locM = mm.match(/(位置|Location|Loc|ページ|Page)[:：\s]*([0-9\-–,]+)/i);
-                                                    if (locM) { location = locM[2].trim(); break; }
-                                                }
-                                            }
-                                            sib = sib.previousElementSibling;
-                                        }
-                                    }
-
-                                    // 3) フォールバック: 文書内のメタ要素から最も近いものを選ぶ
-                                    if (!location) {
-                                        const metas = Array.from(document.querySelectorAll('#annotationHighlightHeader, .kp-notebook-metadata')).filter(e => e && e.innerText && /(位置|Location|Loc|ページ|Page)/.test(e.innerText));
-                                        if (metas.length) {
-                                            let best = null; let bestDist = Infinity;
-                                            const nrect = n.getBoundingClientRect ? n.getBoundingClientRect() : {top:0,bottom:0};
-                                            metas.forEach(m => {
-                                                try {
-                                                    const r = m.getBoundingClientRect();
-                                                    const dist = Math.abs((r.top + r.bottom)/2 - (nrect.top + nrect.bottom)/2);
-                                                    if (dist < bestDist) { bestDist = dist; best = m; }
-                                                } catch (e) {}
-                                            });
-                                            if (best && best.innerText) {
-                                                const mm = norm(best.innerText);
-                                                const locM = mm.match(/(位置|Location|Loc|ページ|Page)[:：\s]*([0-9\-–,]+)/i);
-                                                if (locM) location = locM[2].trim();
-                                            }
-                                        }
-                                    }
-                                } catch (e) {
-                                    // ignore
-                                }
-
-                                            // 最終フォールバック: ノード自身のテキストに位置情報が含まれているか確認
-                                            if (!location) {
-                                                const locM2 = full.match(/(位置|Location|Loc|ページ|Page)[:：\s]*([^\n|\|]+)/i);
-                                                if (locM2) location = locM2[2].trim();
-                                            }
-
-                                            // 位置文字列を正規化して数値部分のみを取り出す（例: '位置: 114' -> '114'）
-                                            try {
-                                                if (location) {
-                                                    // remove non-numeric leading/trailing characters except range/delimiters
-                                                    const m = location.match(/([0-9]+(?:[\-–,][0-9]+)*)/);
-                                                    if (m) location = m[1]; else location = location.replace(/[^0-9\-–,]/g,'').trim();
-                                                }
-                                            } catch (e) {
-                                                // ignore
-                                            }
-
-                    // メモ（Note）抽出
-                    const noteM = full.match(/(Note|メモ|注釈)[:：\s]*([^\n]+)/i);
-                    const note = noteM ? noteM[2].trim() : "";
-
-                    // セクション見出しを祖先から取得
-                    let section = "";
-                    let anc = n;
-                    while (anc && anc !== document.body) {
-                        if (/H[1-6]/i.test(anc.tagName)) { section = norm(anc.innerText); break; }
-                        anc = anc.parentElement;
-                    }
-
-                    // ハイライト本文は full から位置・メモ表記を取り除く
-                    let highlight = full;
-                    if (location) highlight = highlight.replace(location, "");
-                    if (note) highlight = highlight.replace(note, "");
-                    highlight = highlight.replace(/(位置|Location|Loc|ページ|Page)[:：]*/ig, '');
-                    highlight = highlight.replace(/(Note|メモ|注釈)[:：]*/ig, '');
-                    highlight = highlight.replace(/\|/g,' ');
-                    highlight = highlight.replace(/\s+/g,' ').trim();
-
-                    results.push({section, location, highlight, note});
-                } catch (e) {
-                    // 個別要素の解析失敗は無視
-                }
-            });
-            const seen = new Set();
-            const uniq = [];
-            for (const r of results) {
-                const key = (r.highlight||"").slice(0,300);
-                if (!key || seen.has(key)) continue;
-                seen.add(key);
-                uniq.push(r);
-            }
-            return uniq;
-        }
-        '''
+async def ensure_library_pane(page, timeout=5000, reset=False) -> None:
+    """左一覧が見えていればそのまま使い、消えている場合だけトップへ再遷移して復元する。
+       reset が真なら（処理に失敗した直後など）一覧が見えていても必ずトップへ再遷移する。
+       履歴を戻る（go_back）は使わない: 追加ワーカーのタブでは about:blank、ログイン直後はサインイン画面に戻ってしまう
+    """
+    if not reset:
+        try:
+            await page.wait_for_function(LIBRARY_PANE_JS, timeout=timeout)
+            return
+        except Exception:
+            pass
+    try:
+        await page.goto(BASE_URL)
+        await page.wait_for_selector("a", timeout=10000)
+    except Exception:
+        await asyncio.sleep(1.0)
 
+async def extract_annotations_for_current_book(page) -> Tuple[str, List[Dict]]:
+        """現在表示されている書籍の ASIN とハイライトをページ内 JS で一度に抽出して (asin, items) を返す"""
         try:
-                items = await page.evaluate(extract_js)
+                res = await call_page_helper(page, "__kindleExtract")
                 normalized = []
-                for it in items:
+                for it in res.get("items", []):
                         normalized.append({
                                 "section": normalize_whitespace(it.get("section", "")),
                                 "location": normalize_whitespace(it.get("location", "")),
                                 "highlight": normalize_whitespace(it.get("highlight", "")),
                                 "note": normalize_whitespace(it.get("note", "")),
                         })
-                return normalized
+                return normalize_whitespace(res.get("asin", "")), normalized
         except Exception:
-                return []
+                return "", []
+
+def load_processed_books(path: str):
+    """
+    既存の出力 CSV から処理済みの書名（正規化済み）の集合を返す。
+    ファイルが無い／空の場合は None（ヘッダから書き始める）。
+    Book 列は書き込み側で常に先頭なので、通常は各行の最初のカンマまでを読むだけで済ませ、
+    引用符付きの行は csv で1行だけ解析する。複数行にまたがるレコードがあれば csv.reader で読み直す。
+    """
+    try:
+        rf = open(path, "r", newline="", encoding="utf-8-sig")
+    except FileNotFoundError:
+        return None
+    with rf:
+        header_line = rf.readline()
+        if not header_line:
+            return None
+        header = next(csv.reader([header_line]), [])
+        # 既存行から Book 列を取得（ヘッダがあることを期待）
+        book_idx = 0
+        for i, h in enumerate(header):
+            if h and h.strip().lower().startswith("book"):
+                book_idx = i
+                break
+
+        seen = set()
+        if book_idx == 0:
+            for line in rf:
+                if line.count('"') % 2:
+                    # 引用符が閉じていない＝改行を含むフィールドがある。全体を csv で読み直す
+                    break
+                if line.startswith('"'):
+                    row = next(csv.reader([line]), [])
+                    b = row[0] if row else ""
+                else:
+                    b = line.split(",", 1)[0]
+                b = normalize_whitespace(b)
+                if b:
+                    seen.add(b)
+            else:
+                return seen
+            rf.seek(0)
+            rf.readline()
+            seen = set()
+
+        for row in csv.reader(rf):
+            try:
+                b = row[book_idx]
+            except Exception:
+                b = row[0] if row else ""
+            if b:
+                seen.add(normalize_whitespace(b))
+        return seen
 
 async def main(args):
     async with async_playwright() as p:
         context = await p.chromium.launch_persistent_context(USER_DATA_DIR, headless=not args.headful,
                                                              viewport={"width":1200,"height":900})
+        # 抽出・スクロール用のページ内関数は文書ごとに一度だけ登録しておく
+        await context.add_init_script(PAGE_HELPERS_INIT_JS)
         page = await context.new_page()
         print("Opening:", BASE_URL)
         await page.goto(BASE_URL)
         if args.headful:
             input("ヘッドフルモード: ブラウザで Amazon にログイン後、Enter を押してください...")
+        # ログイン画面（画像認証など）を壊さないよう、ブロックはログイン後に有効化する
+        await block_non_essential_resources(page)
 
         try:
             await page.wait_for_selector("a", timeout=DEFAULT_TIMEOUT)
@@ -507,147 +723,123 @@ async def main(args):
 
         print(f"検出した書籍数: {len(titles)} 件（上限 500 件）")
         titles = titles[:500]
+        # 処理済み判定に使う正規化済みの書名は一度だけ作っておく
+        norm_titles = [normalize_whitespace(t) for t in titles]
 
         # 出力先ファイルを事前に決め、既存の CSV から処理済みの書籍を読み取って続行可能にする
         path = args.output
-        seen = set()
-        write_header = True
-        if os.path.exists(path) and os.path.getsize(path) > 0:
-            try:
-                with open(path, "r", newline="", encoding="utf-8-sig") as rf:
-                    reader = csv.reader(rf)
-                    header = next(reader, None)
-                    # 既存行から Book 列を取得（ヘッダがあることを期待）
-                    book_idx = 0
-                    if header:
-                        # try to find Book column index
-                        for i, h in enumerate(header):
-                            if h and h.strip().lower().startswith("book"):
-                                book_idx = i
-                                break
-                    for row in reader:
-                        try:
-                            b = row[book_idx]
-                        except Exception:
-                            b = row[0] if row else ""
-                        if b:
-                            seen.add(normalize_whitespace(b))
-                write_header = False
-            except Exception:
-                # 読み込み失敗でも続行（既存ファイルが壊れている可能性がある）
-                seen = set()
-                write_header = True
-
-        # 出力ファイルを追記モードで開いて、各書籍処理後に追記する
         try:
-            out_f = open(path, "a", newline="", encoding="utf-8-sig")
+            seen = load_processed_books(path)
+            write_header = seen is None
+        except Exception:
+            # 読み込み失敗でも続行（既存ファイルが壊れている可能性がある）
+            seen = None
+            write_header = True
+        if seen is None:
+            seen = set()
+
+        # 出力ファイルを追記モードで開いて、各書籍処理後に追記する。
+        # ディスクへの同期（fsync）は FSYNC_EVERY 冊ごとと終了時のみ行う
+        try:
+            out_f = open(path, "a", newline="", encoding="utf-8-sig", buffering=OUTPUT_BUFFER_SIZE)
         except Exception:
             print(f"出力ファイルを開けません: {path}")
             await context.close()
             return
         writer = csv.writer(out_f)
-        if write_header:
-            # Add ASIN column and include it in rows
-            writer.writerow(["Book", "ASIN", "Section", "Location", "Highlight", "Note"]) 
+
+        def sync_output():
             out_f.flush()
             try:
                 os.fsync(out_f.fileno())
             except Exception:
                 pass
 
-        for idx, title in enumerate(titles, start=1):
-            if normalize_whitespace(title) in seen:
-                print(f"[{idx}/{len(titles)}] スキップ済み: {title}")
-                continue
-            print(f"[{idx}/{len(titles)}] 処理中: {title}")
-            # safe_click_and_wait を使用してコンソールエラーやハングを回避しつつクリック
-            ok = await safe_click_and_wait(page, title, click_book_by_title, wait_for_book_context, timeout=DEFAULT_TIMEOUT, max_reloads=2)
-            if not ok:
-                print("  -> クリック/検出に失敗しました（スキップ）")
-                try:
-                    await page.goto(BASE_URL)
-                    await page.wait_for_selector("a", timeout=10000)
-                except Exception:
-                    pass
-                continue
-
-            # ここから：コンテキスト検出前に少し待ち、複数回リトライする
-            ctx_ok = False
-            for attempt_ctx in range(3):
-                # 試行ごとに待機を増やす（0.5s, 1.0s, 1.5s）
-                await asyncio.sleep(0.5 * (attempt_ctx + 1))
-                # 非同期読み込みがあれば完了を待つ（失敗しても無視）
-                try:
-                    await page.wait_for_load_state('networkidle', timeout=3000)
-                except Exception:
-                    pass
-                try:
-                    ctx_ok = await wait_for_book_context(page, title, timeout=15000)
-                except Exception:
-                    ctx_ok = False
-                if ctx_ok:
-                    break
-                # 次の試行前に短く待機
-                await asyncio.sleep(0.6)
-
-            if not ctx_ok:
-                print("  -> 対象書籍のコンテキスト検出に失敗しました（スキップ）")
+        if write_header:
+            # Add ASIN column and include it in rows
+            writer.writerow(["Book", "ASIN", "Section", "Location", "Highlight", "Note"]) 
+            sync_output()
+        unsynced_books = 0
+
+        # 書籍は互いに独立しているため、同じコンテキスト内に複数のページ（タブ）を開き、
+        # キューから書名を取り出して並行に処理する（--workers、既定は 1 で従来どおり逐次）
+        workers = max(1, getattr(args, "workers", 1) or 1)
+        queue: asyncio.Queue = asyncio.Queue()
+        for idx, (title, nt) in enumerate(zip(titles, norm_titles), start=1):
+            queue.put_nowait((idx, title, nt))
+
+        async def worker(wpage):
+            nonlocal unsynced_books
+            # コンソールエラーの監視はページごとに一度だけ登録する
+            error_state = watch_console_errors(wpage)
+            while True:
                 try:
-                    await page.goto(BASE_URL)
-                    await page.wait_for_selector("a", timeout=10000)
-                except Exception:
-                    pass
-                continue
-            # ページ内の hidden ASIN 要素から ASIN を取得
-            asin_val = ""
-            try:
-                raw_asin = await page.locator("#kp-notebook-annotations-asin").get_attribute("value")
-                if raw_asin:
-                    asin_val = normalize_whitespace(raw_asin)
-            except Exception:
-                asin_val = ""
+                    idx, title, nt = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                if nt in seen:
+                    print(f"[{idx}/{len(titles)}] スキップ済み: {title}")
+                    continue
+                print(f"[{idx}/{len(titles)}] 処理中: {title}")
+                # safe_click_and_wait を使用してコンソールエラーやハングを回避しつつクリック
+                ok = await safe_click_and_wait(wpage, title, click_book_by_title, wait_for_book_context, timeout=DEFAULT_TIMEOUT, max_reloads=2, error_state=error_state)
+                # True はコンテキスト検出（wait_for_book_context）まで済んだことを意味するので、ここで再検証はしない
+                if not ok:
+                    print("  -> クリック/検出に失敗しました（スキップ）")
+                    # 失敗が続いたページは、一覧が見えていてもトップから開き直す
+                    await ensure_library_pane(wpage, reset=True)
+                    continue
 
-            items = await extract_annotations_for_current_book(page)
-            print(f"  -> 抽出件数: {len(items)}")
-            # 一冊分を即時追記（Highlight dataclass を使って明示的に asin を含める）
-            for it in items:
-                try:
-                    h = Highlight(book=title,
-                                  section=it.get("section", ""),
-                                  location=it.get("location", ""),
-                                  highlight=it.get("highlight", ""),
-                                  note=it.get("note", ""),
-                                  asin=asin_val)
-                    writer.writerow([h.book, h.asin, h.section, h.location, h.highlight, h.note])
-                except Exception:
-                    # 保険: 文字列化して書き込む
-                    writer.writerow([str(title), str(asin_val), str(it.get("section","")), str(it.get("location","")), str(it.get("highlight","")), str(it.get("note",""))])
-            out_f.flush()
-            try:
-                os.fsync(out_f.fileno())
-            except Exception:
-                pass
-            seen.add(normalize_whitespace(title))
-            # 左一覧がまだ見えているなら毎回トップへ戻さない。5秒以内に
-            # "著者:" を含むアンカーが見つからなければトップへ遷移して復元を試みる。
-            try:
-                try:
-                    await page.wait_for_function(
-                        "() => Array.from(document.querySelectorAll('a')).some(a => (a.textContent||'').includes('著者:'))",
-                        timeout=5000,
-                    )
-                    # 5秒以内に左一覧が見つかった -> ナビゲーション不要
-                except Exception:
-                    # 見つからなかった場合はトップに戻して待機
+                # ページ内の hidden ASIN 要素とハイライトを1回の呼び出しで取得
+                asin_val, items = await extract_annotations_for_current_book(wpage)
+                print(f"  -> 抽出件数: {len(items)}")
+                # 一冊分の行をまとめて追記（Highlight dataclass を使って明示的に asin を含める）
+                rows = []
+                for it in items:
                     try:
-                        await page.goto(BASE_URL)
-                        await page.wait_for_selector("a", timeout=10000)
+                        h = Highlight(book=title,
+                                      section=it.get("section", ""),
+                                      location=it.get("location", ""),
+                                      highlight=it.get("highlight", ""),
+                                      note=it.get("note", ""),
+                                      asin=asin_val)
+                        rows.append([h.book, h.asin, h.section, h.location, h.highlight, h.note])
                     except Exception:
-                        await asyncio.sleep(1.0)
+                        # 保険: 文字列化して書き込む
+                        rows.append([str(title), str(asin_val), str(it.get("section","")), str(it.get("location","")), str(it.get("highlight","")), str(it.get("note",""))])
+                writer.writerows(rows)
+                unsynced_books += 1
+                if unsynced_books >= FSYNC_EVERY:
+                    sync_output()
+                    unsynced_books = 0
+                seen.add(nt)
+                # 左一覧がまだ見えているなら毎回トップへ戻さず、次の書籍をそのままクリックする。
+                # 見つからない場合のみトップへ遷移して復元する。
+                await ensure_library_pane(wpage)
+
+        pages = [page]
+        for _ in range(1, min(workers, len(titles))):
+            extra = await context.new_page()
+            await block_non_essential_resources(extra)
+            try:
+                await extra.goto(BASE_URL)
+                await extra.wait_for_selector("a", timeout=DEFAULT_TIMEOUT)
             except Exception:
-                await asyncio.sleep(1.0)
-
-        out_f.close()
+                print("  -> 追加ワーカー用のページを開けませんでした（このワーカーは使いません）")
+                await extra.close()
+                continue
+            pages.append(extra)
+        # 書き込みは1冊分ずつ await を挟まずに行うため、ワーカー間で行が混ざることはない。
+        # TaskGroup は1つのワーカーが例外で止まると残りを取り消し、全員の終了を待ってから抜けるので、
+        # 他のワーカーが閉じたファイルに書き込むことはない
+        try:
+            async with asyncio.TaskGroup() as tg:
+                for pg in pages:
+                    tg.create_task(worker(pg))
+        finally:
+            # 正常終了でも中断（Ctrl+C など）でも、未同期の行をディスクへ書き出してから閉じる
+            sync_output()
+            out_f.close()
         print(f"処理が完了しました。出力ファイル: {path}")
         await context.close()
 
@@ -655,5 +847,6 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Export Kindle highlights per book (scroll + click).")
     parser.add_argument("--headful", action="store_true", help="Open browser so you can login interactively.")
     parser.add_argument("--output", "-o", default="_out/highlights.csv", help="CSV output path")
+    parser.add_argument("--workers", "-w", type=int, default=1, help="Number of pages processing books in parallel")
     args = parser.parse_args()
     asyncio.run(main(args))